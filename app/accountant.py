@@ -0,0 +1,177 @@
+import time
+import asyncio
+import logging
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import aiohttp
+
+import config
+from app.constants import (
+    ACCOUNTANT_COALESCE_WINDOW_IN_MS,
+    ACCOUNTANT_BALANCES_CHUNK_SIZE,
+    ACCOUNTANT_REQUEST_TIMEOUT_IN_SECONDS,
+    ACCOUNTANT_MAX_RETRIES,
+    ACCOUNTANT_RETRY_BACKOFF_IN_SECONDS,
+    ACCOUNTANT_BALANCE_CACHE_TTL_IN_SECONDS,
+    ACCOUNTANT_MAX_CONNECTIONS,
+    ACCOUNTANT_MAX_CONCURRENT_REQUESTS,
+)
+
+
+class AccountantError(Exception):
+    pass
+
+
+class AccountantClient:
+    """
+    Long-lived client for The Accountant API.
+    Concurrent balance lookups are coalesced into one /balances request and cached for a short time.
+    """
+
+    def __init__(
+        self,
+        api_path: str = config.ACCOUNTANT_API_PATH,
+        coalesce_window_in_ms: int = ACCOUNTANT_COALESCE_WINDOW_IN_MS,
+        cache_ttl_in_seconds: float = ACCOUNTANT_BALANCE_CACHE_TTL_IN_SECONDS,
+    ):
+        self.api_path = api_path
+        self.coalesce_window = coalesce_window_in_ms / 1000
+        self.cache_ttl = cache_ttl_in_seconds
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._cache: Dict[int, Tuple[float, Decimal]] = {}  # user_id -> (expires_at, balance)
+        self._cache_pruned_at = time.monotonic()
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._requests_semaphore: Optional[asyncio.Semaphore] = None
+        # metrics
+        self.requests_count = 0
+        self.retries_count = 0
+        self.cache_hits = 0
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # session is created lazily because it has to be created inside of running event loop
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=ACCOUNTANT_MAX_CONNECTIONS),
+                timeout=aiohttp.ClientTimeout(total=ACCOUNTANT_REQUEST_TIMEOUT_IN_SECONDS),
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+    async def get_balance(self, user_id: int) -> Decimal:
+        """Get current user balance, lookups for other users made at the same time share one request"""
+        cached = self._get_cached(user_id)
+        if cached is not None:
+            return cached
+        future = self._pending.get(user_id)
+        if future is None:
+            loop = asyncio.get_event_loop()
+            future = self._pending[user_id] = loop.create_future()
+            if self._flush_handle is None:
+                self._flush_handle = loop.call_later(self.coalesce_window, self._flush_pending)
+        # shield, so one cancelled caller doesn't cancel the lookup for everybody else
+        return await asyncio.shield(future)
+
+    async def get_balances(self, users_ids: Iterable[int]) -> Dict[int, Decimal]:
+        """Get current balances of many users, one /balances request per chunk of ids"""
+        users_ids = list(dict.fromkeys(users_ids))
+        chunks = []
+        for start in range(0, len(users_ids), ACCOUNTANT_BALANCES_CHUNK_SIZE):
+            end = start + ACCOUNTANT_BALANCES_CHUNK_SIZE
+            chunks.append(users_ids[start:end])
+        balances = {}
+        for chunk_balances in await asyncio.gather(*[self._fetch_balances(chunk) for chunk in chunks]):
+            balances.update(chunk_balances)
+        return balances
+
+    def _get_cached(self, user_id: int) -> Optional[Decimal]:
+        cached = self._cache.get(user_id)
+        if cached is None:
+            return None
+        expires_at, balance = cached
+        if expires_at < time.monotonic():
+            del self._cache[user_id]
+            return None
+        self.cache_hits += 1
+        return balance
+
+    def _set_cached(self, balances: Dict[int, Decimal]) -> None:
+        now = time.monotonic()
+        if now - self._cache_pruned_at >= self.cache_ttl:
+            # balances which are never read again (e.g. ones fetched by reconciliation) would stay forever
+            self._cache = {user_id: cached for user_id, cached in self._cache.items() if cached[0] >= now}
+            self._cache_pruned_at = now
+        expires_at = now + self.cache_ttl
+        for user_id, balance in balances.items():
+            self._cache[user_id] = (expires_at, balance)
+
+    def _flush_pending(self) -> None:
+        pending, self._pending = self._pending, {}
+        self._flush_handle = None
+        asyncio.ensure_future(self._resolve_pending(pending))
+
+    async def _resolve_pending(self, pending: Dict[int, asyncio.Future]) -> None:
+        try:
+            balances = await self.get_balances(pending)
+        except Exception as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return None
+        for user_id, future in pending.items():
+            if not future.done():
+                future.set_result(balances[user_id])
+
+    async def _fetch_balances(self, users_ids: list) -> Dict[int, Decimal]:
+        if self._requests_semaphore is None:
+            self._requests_semaphore = asyncio.Semaphore(ACCOUNTANT_MAX_CONCURRENT_REQUESTS)
+        async with self._requests_semaphore:
+            response_json = await self._request_balances_with_retries(users_ids)
+
+        # users unknown to The Accountant have zero balance
+        balances = {user_id: Decimal(0) for user_id in users_ids}
+        for position, item in enumerate(response_json):
+            if "id" in item:
+                user_id = int(item["id"])
+            elif len(response_json) == len(users_ids):
+                # ids aren't echoed back, balances are in the same order as requested ids
+                user_id = users_ids[position]
+            elif len(users_ids) > 1:
+                # some users are left out and it's unknown which ones, a response for one user is unambiguous
+                logging.debug(
+                    f":::hodl_bot: The Accountant API left out {len(users_ids) - len(response_json)} users "
+                    f"without saying which ones, requesting {len(users_ids)} balances one by one"
+                )
+                balances = {}
+                for user_balances in await asyncio.gather(*[self._fetch_balances([user_id]) for user_id in users_ids]):
+                    balances.update(user_balances)
+                return balances
+            else:
+                raise AccountantError("The Accountant API response doesn't say which balance belongs to which user")
+            balances[user_id] = Decimal(item["points"])
+        self._set_cached(balances)
+        return balances
+
+    async def _request_balances_with_retries(self, users_ids: list) -> List[dict]:
+        for attempt in range(ACCOUNTANT_MAX_RETRIES + 1):
+            try:
+                self.requests_count += 1
+                async with self.session.post(
+                    f"{self.api_path}/balances", json={"ids": [str(user_id) for user_id in users_ids]}
+                ) as response:
+                    if response.status >= 500:
+                        raise AccountantError(f"The Accountant API responded with {response.status}")
+                    response.raise_for_status()
+                    return await response.json()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError, AccountantError) as e:
+                if attempt == ACCOUNTANT_MAX_RETRIES:
+                    raise
+                self.retries_count += 1
+                backoff = ACCOUNTANT_RETRY_BACKOFF_IN_SECONDS * 2 ** attempt
+                logging.debug(f":::hodl_bot: The Accountant API request failed ({e}), retrying in {backoff}s")
+                await asyncio.sleep(backoff)
@@ -0,0 +1,417 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import pathlib
+import datetime
+from decimal import Decimal
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from sentry_sdk import capture_exception
+from tortoise.transactions import in_transaction
+
+from app.metrics import timed, POINTS_LOG_EVENTS, POINTS_LOG_QUEUE_DEPTH, POINTS_LOG_FLUSH_SIZE
+from app.caches import StakingRegistry, RecentMessagesIds
+from app.constants import (
+    POINTS_LOG_FLUSH_INTERVAL_IN_MS,
+    POINTS_LOG_BATCH_SIZE,
+    POINTS_LOG_RETRY_BACKOFF_IN_SECONDS,
+    POINTS_LOG_MAX_RETRY_BACKOFF_IN_SECONDS,
+    RECENT_MESSAGES_IDS_CACHE_SIZE,
+)
+from app.queries import (
+    APPLY_BALANCE_DELTAS,
+    UPSERT_MESSAGE_ID_CHECKPOINT,
+    INSERT_BALANCE_EVENTS,
+    LOCK_EPOCHS_CREATION_SHARED,
+    SELECT_EPOCHS_ENDING_AFTER,
+)
+
+
+# id of the latest points log message which doesn't need to be processed again, used to catch up after downtime
+POINTS_LOG_HIGH_WATER_MARK = "points_log_high_water_mark"
+
+
+class PointsEvent(NamedTuple):
+    """Points transfer parsed from points log channel"""
+
+    message_id: int
+    created_at: datetime.datetime
+    sender_id: int
+    receivers_ids: List[int]
+    points: Decimal
+    epochs_ids: Tuple[int, ...] = ()  # epochs which the event counts towards, chosen when it's written
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "message_id": self.message_id,
+                "created_at": self.created_at.isoformat(),
+                "sender_id": self.sender_id,
+                "receivers_ids": self.receivers_ids,
+                "points": str(self.points),
+                "epochs_ids": self.epochs_ids,
+            }
+        )
+
+    @classmethod
+    def from_json(cls, line: str) -> "PointsEvent":
+        data = json.loads(line)
+        return cls(
+            message_id=data["message_id"],
+            created_at=datetime.datetime.fromisoformat(data["created_at"]),
+            sender_id=data["sender_id"],
+            receivers_ids=data["receivers_ids"],
+            points=Decimal(data["points"]),
+            epochs_ids=tuple(data.get("epochs_ids", ())),
+        )
+
+    def deltas(self) -> Iterator[Tuple[int, Decimal]]:
+        """Balance changes in the same order as they were applied by the unbatched handler (sender first)"""
+        yield self.sender_id, -self.points
+        for receiver_id in set(self.receivers_ids):
+            yield receiver_id, self.points
+
+
+def aggregate_events(
+    events: List[PointsEvent], staking_users_ids: set
+) -> Tuple[Dict[int, Decimal], Dict[Tuple[int, int], Decimal]]:
+    """
+    Collapse a batch of events into a net delta per user and the lowest running delta per (user, epoch).
+    Running deltas are relative to the user balance before the batch, so epoch_lowest_balance stays exact
+    as long as events come in the order they happened. An event replayed after newer ones were already flushed
+    is applied on top of them, so the minimum it makes can still differ from the one it would have made in time.
+    """
+    net_deltas: Dict[int, Decimal] = {}
+    lowest_deltas: Dict[Tuple[int, int], Decimal] = {}
+    for event in events:
+        for user_id, delta in event.deltas():
+            if user_id not in staking_users_ids:
+                continue
+            running_delta = net_deltas.get(user_id, Decimal(0)) + delta
+            net_deltas[user_id] = running_delta
+            for epoch_id in event.epochs_ids:
+                key = (user_id, epoch_id)
+                if key not in lowest_deltas or running_delta < lowest_deltas[key]:
+                    lowest_deltas[key] = running_delta
+    return net_deltas, lowest_deltas
+
+
+def write_wal(path: pathlib.Path, events: List[PointsEvent]) -> None:
+    """Write events to a temporary file first, so a crash while writing doesn't leave a truncated file behind"""
+    temporary_path = path.with_name(f"{path.name}.tmp")
+    with open(temporary_path, "w") as wal_file:
+        wal_file.writelines(f"{event.to_json()}\n" for event in events)
+        wal_file.flush()
+        os.fsync(wal_file.fileno())
+    os.replace(temporary_path, path)
+
+
+def read_wal(path: pathlib.Path) -> List[PointsEvent]:
+    with open(path) as wal_file:
+        return [PointsEvent.from_json(line) for line in wal_file if line.strip()]
+
+
+class PointsEventBatcher:
+    """
+    Buffers points log events and writes them to database in one transaction per batch.
+    Events which weren't written by shutdown are saved to a write-ahead file and restored on the next start.
+    """
+
+    def __init__(
+        self,
+        staking_registry: StakingRegistry,
+        flush_interval_in_ms: int = POINTS_LOG_FLUSH_INTERVAL_IN_MS,
+        batch_size: int = POINTS_LOG_BATCH_SIZE,
+    ):
+        self.staking_registry = staking_registry
+        self.flush_interval = flush_interval_in_ms / 1000
+        self.batch_size = batch_size
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.event_queued = asyncio.Event()  # wakes up run while it collects a batch
+        # live events and replayed history can overlap
+        self.recent_messages_ids = RecentMessagesIds(RECENT_MESSAGES_IDS_CACHE_SIZE)
+        self.last_submitted_message_id = 0
+        # high water mark stays below events which were submitted but aren't written yet, failed ones included
+        self.unflushed_messages_ids: Set[int] = set()
+        # and below channel history which has to be replayed, see request_replay
+        self.replay_after: Optional[int] = None  # replay which hasn't started yet
+        self.replay_cursor: Optional[int] = None  # latest message submitted by the running replay
+        self.is_closed = False  # events aren't accepted during shutdown
+        self.in_flight_events: List[PointsEvent] = []  # batch which is being collected or flushed right now
+        # retried with backoff until they are written, saved by shutdown if they still aren't
+        self.failed_events: List[PointsEvent] = []
+        self.retry_backoff = POINTS_LOG_RETRY_BACKOFF_IN_SECONDS
+        self.retry_at = 0.0  # event loop time of the next retry of failed events
+        # metrics
+        self.flushes_count = 0
+        self.flushed_events_count = 0
+        self.failed_events_count = 0
+        self.duplicate_events_count = 0  # events which were already in the ledger
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+
+    async def submit(self, event: PointsEvent) -> bool:
+        """Queue event for the next flush, returns False if it was skipped"""
+        if self.is_closed:
+            # not even moving last_submitted_message_id, so the event is replayed from channel history
+            POINTS_LOG_EVENTS.inc("rejected")
+            return False
+        if not self.recent_messages_ids.add(event.message_id):
+            POINTS_LOG_EVENTS.inc("duplicate")
+            return False
+        self.last_submitted_message_id = max(self.last_submitted_message_id, event.message_id)
+        # skip events where nobody is staking without touching database
+        if not self.staking_registry.filter_staking({event.sender_id, *event.receivers_ids}):
+            POINTS_LOG_EVENTS.inc("skipped")
+            return False
+        self.queue.put_nowait(event)
+        self.unflushed_messages_ids.add(event.message_id)
+        self.event_queued.set()
+        POINTS_LOG_QUEUE_DEPTH.set(self.queue_depth)
+        return True
+
+    def request_replay(self, after_message_id: int) -> None:
+        """Channel history after given message has to be replayed, e.g. it was posted while bot was offline"""
+        if self.replay_after is None or after_message_id < self.replay_after:
+            self.replay_after = after_message_id
+
+    def start_replay(self) -> int:
+        """Take the requested replay, high water mark stays below messages it hasn't submitted yet"""
+        after_message_id, self.replay_after = self.replay_after, None
+        self.replay_cursor = after_message_id
+        return after_message_id
+
+    def get_high_water_mark(self, events: List[PointsEvent]) -> int:
+        """The latest message id which doesn't need to be processed again once `events` are written"""
+        messages_ids = {event.message_id for event in events}
+        # every submitted event up to here is either in this batch, still unflushed or was skipped
+        high_water_mark = max(self.last_submitted_message_id, *messages_ids)
+        unflushed_messages_ids = self.unflushed_messages_ids - messages_ids
+        if unflushed_messages_ids:
+            high_water_mark = min(high_water_mark, min(unflushed_messages_ids) - 1)
+        for replayed_until in (self.replay_after, self.replay_cursor):
+            if replayed_until is not None:
+                high_water_mark = min(high_water_mark, replayed_until)
+        return high_water_mark
+
+    async def checkpoint_idle(self, message_id: int) -> bool:
+        """
+        Move high water mark up to given message while nothing is pending, so it keeps up with time
+        in a quiet channel (settlement waits for it). Returns False if something is pending.
+        """
+        if self.is_closed or self.queue_depth or self.in_flight_events or self.unflushed_messages_ids:
+            return False
+        if self.replay_after is not None or self.replay_cursor is not None:
+            return False
+        # everything up to here was received and is written or skipped, a disconnect replays from here
+        self.last_submitted_message_id = max(self.last_submitted_message_id, message_id)
+        async with in_transaction() as connection:
+            await connection.execute_query(
+                UPSERT_MESSAGE_ID_CHECKPOINT, [POINTS_LOG_HIGH_WATER_MARK, str(self.last_submitted_message_id)]
+            )
+        return True
+
+    async def drain(self) -> None:
+        """Wait until all queued events are flushed"""
+        await self.queue.join()
+
+    @property
+    def queue_depth(self) -> int:
+        return self.queue.qsize()
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "flushes_count": self.flushes_count,
+            "flushed_events_count": self.flushed_events_count,
+            "failed_events_count": self.failed_events_count,
+            "duplicate_events_count": self.duplicate_events_count,
+            "last_flush_latency": self.last_flush_latency,
+            "max_flush_latency": self.max_flush_latency,
+        }
+
+    async def run(self) -> None:
+        """Consume the queue forever, flushing every flush_interval or every batch_size events"""
+        loop = asyncio.get_event_loop()
+        while True:
+            if self.failed_events and loop.time() >= self.retry_at:
+                await self.retry_failed_events()
+            if self.queue.empty():
+                await self.wait_until_queued(self.retry_at - loop.time() if self.failed_events else None)
+                continue
+            batch = [self.queue.get_nowait()]
+            # batch is in flight since it left the queue, it's saved by shutdown while it's collected as well
+            self.in_flight_events = batch
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                if not self.queue.empty():
+                    # taken without awaiting, so an event is always either in the queue or in the batch
+                    batch.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                await self.wait_until_queued(timeout)
+            POINTS_LOG_QUEUE_DEPTH.set(self.queue_depth)
+            try:
+                with timed("points_log.flush"):
+                    await self.flush(batch)
+            except Exception as e:
+                self.failed_events.extend(batch)
+                self.failed_events_count += len(batch)
+                POINTS_LOG_EVENTS.inc("failed", amount=len(batch))
+                logging.error(f":::hodl_bot: failed to flush {len(batch)} points log events: {e}")
+                capture_exception(e)
+            finally:
+                self.in_flight_events = []
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def retry_failed_events(self) -> None:
+        """Failed events are flushed on their own, so events which can't be written don't hold back the live ones"""
+        events = list(self.failed_events)
+        try:
+            with timed("points_log.retry"):
+                await self.flush(events)
+        except Exception as e:
+            self.retry_at = asyncio.get_event_loop().time() + self.retry_backoff
+            self.retry_backoff = min(self.retry_backoff * 2, POINTS_LOG_MAX_RETRY_BACKOFF_IN_SECONDS)
+            logging.error(f":::hodl_bot: failed to retry {len(events)} points log events: {e}")
+            capture_exception(e)
+            return None
+        # only run adds failed events, nothing was added while they were retried
+        self.failed_events = []
+        self.retry_backoff = POINTS_LOG_RETRY_BACKOFF_IN_SECONDS
+        logging.info(f":::hodl_bot: retried {len(events)} failed points log events")
+
+    async def wait_until_queued(self, timeout: Optional[float]) -> None:
+        """
+        Wait until an event is queued or `timeout` is over. Unlike asyncio.wait_for(queue.get()) this doesn't take
+        an event which could be lost and doesn't swallow cancellation when both happen at once (bpo-42130),
+        which would hang shutdown.
+        """
+        self.event_queued.clear()
+        waiter = asyncio.ensure_future(self.event_queued.wait())
+        try:
+            await asyncio.wait([waiter], timeout=timeout)
+        finally:
+            waiter.cancel()
+
+    async def shutdown(self, wal_path: pathlib.Path, timeout: float) -> int:
+        """
+        Stop accepting events, give queued ones `timeout` seconds to be flushed and save the rest to `wal_path`.
+        Events of the batch which is being flushed are saved as well, ledger skips them if the flush succeeds.
+        Returns amount of saved events.
+        """
+        self.is_closed = True
+        try:
+            await asyncio.wait_for(self.drain(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f":::hodl_bot: {self.queue_depth} points log events weren't flushed in {timeout}s")
+        events = [*self.failed_events, *self.in_flight_events]
+        while not self.queue.empty():
+            events.append(self.queue.get_nowait())
+            self.queue.task_done()
+        POINTS_LOG_QUEUE_DEPTH.set(self.queue_depth)
+        if events:
+            if wal_path.exists():
+                # events of the previous shutdown which weren't restored
+                events = [*read_wal(wal_path), *events]
+            write_wal(wal_path, events)
+        return len(events)
+
+    async def restore(self, wal_path: pathlib.Path) -> int:
+        """
+        Flush events saved by the previous shutdown, must be done before live events are submitted.
+        The file is removed only once all events are written, returns amount of restored events.
+        """
+        if not wal_path.exists():
+            return 0
+        events = read_wal(wal_path)
+        for start in range(0, len(events), self.batch_size):
+            end = start + self.batch_size
+            await self.flush(events[start:end])
+        wal_path.unlink()
+        return len(events)
+
+    async def flush(self, events: List[PointsEvent]) -> None:
+        started_at = time.perf_counter()
+        new_events_count = await self._apply(events, self.get_high_water_mark(events))
+        self.unflushed_messages_ids.difference_update(event.message_id for event in events)
+        self.duplicate_events_count += len(events) - new_events_count
+        POINTS_LOG_EVENTS.inc("processed", amount=new_events_count)
+        POINTS_LOG_EVENTS.inc("duplicate", amount=len(events) - new_events_count)
+        POINTS_LOG_FLUSH_SIZE.observe(len(events))
+
+        self.last_flush_latency = time.perf_counter() - started_at
+        self.max_flush_latency = max(self.max_flush_latency, self.last_flush_latency)
+        self.flushes_count += 1
+        self.flushed_events_count += len(events)
+        logging.debug(f":::hodl_bot: flushed {len(events)} points log events, stats: {self.stats()}")
+
+    async def _apply(self, events: List[PointsEvent], high_water_mark: int) -> int:
+        """Apply events which weren't applied before in one transaction, returns amount of such events"""
+        async with in_transaction() as connection:
+            # epochs are chosen under the lock, so an epoch created while the batch waited to be written
+            # (its UserEpoch rows were copied from balances before the batch) counts the batch as well
+            await connection.execute_query(LOCK_EPOCHS_CREATION_SHARED)
+            events = await self._with_epochs(connection, events)
+            # high water mark is moved in the same transaction as balances of the events it covers
+            await connection.execute_query(
+                UPSERT_MESSAGE_ID_CHECKPOINT, [POINTS_LOG_HIGH_WATER_MARK, str(high_water_mark)]
+            )
+            # append events to the ledger, ones which are already there were applied before
+            rows = await connection.execute_query_dict(
+                INSERT_BALANCE_EVENTS,
+                [
+                    [event.message_id for event in events],
+                    [event.sender_id for event in events],
+                    [json.dumps(event.receivers_ids) for event in events],
+                    [event.points for event in events],
+                    [json.dumps(event.epochs_ids) for event in events],
+                    [event.created_at for event in events],
+                ],
+            )
+            new_messages_ids = {row["id"] for row in rows}
+            new_events = []
+            for event in events:
+                if event.message_id in new_messages_ids:
+                    new_messages_ids.discard(event.message_id)
+                    new_events.append(event)
+            # replayed and retried events are queued after newer live ones, while the running minimum
+            # needs them in the order they happened (message ids are snowflakes, so they follow time)
+            new_events.sort(key=lambda event: event.message_id)
+            net_deltas, lowest_deltas = aggregate_events(new_events, self.staking_registry.staking_users_ids)
+            if net_deltas:
+                await self._apply_deltas(connection, net_deltas, lowest_deltas)
+        return len(new_events)
+
+    @staticmethod
+    async def _with_epochs(connection, events: List[PointsEvent]) -> List[PointsEvent]:
+        """Every epoch which hasn't ended before the event happened counts it"""
+        _, epochs = await connection.execute_query(
+            SELECT_EPOCHS_ENDING_AFTER, [min(event.created_at for event in events)]
+        )
+        return [
+            event._replace(
+                epochs_ids=tuple(epoch["id"] for epoch in epochs if epoch["end_datetime"] >= event.created_at)
+            )
+            for event in events
+        ]
+
+    @staticmethod
+    async def _apply_deltas(
+        connection, net_deltas: Dict[int, Decimal], lowest_deltas: Dict[Tuple[int, int], Decimal]
+    ) -> None:
+        await connection.execute_query(
+            APPLY_BALANCE_DELTAS,
+            [
+                list(net_deltas),
+                list(net_deltas.values()),
+                [user_id for user_id, _ in lowest_deltas],
+                [epoch_id for _, epoch_id in lowest_deltas],
+                list(lowest_deltas.values()),
+            ],
+        )
@@ -0,0 +1,135 @@
+import logging
+import datetime
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set
+
+from app.models import User, Epoch
+from app.metrics import STAKING_REGISTRY_LOOKUPS
+
+
+class StakingRegistry:
+    """In-memory set of staking users, User.is_staking stays the source of truth"""
+
+    def __init__(self):
+        self.staking_users_ids: Set[int] = set()
+        self.is_loaded = False
+        # hits are lookups of staking users, misses are lookups of non staking users (no database query needed)
+        self.hits = 0
+        self.misses = 0
+        # changes made while load or reconcile query is running, they are re-applied on top of database state
+        self._changes_during_reconcile: Optional[Dict[int, bool]] = None
+
+    async def load(self) -> None:
+        # notifications are already listened to while the bot warms up, changes they make aren't lost
+        self.staking_users_ids = await self._fetch_staking_users_ids()
+        self.is_loaded = True
+
+    async def reconcile(self) -> int:
+        """Sync registry with database, returns amount of users which drifted"""
+        staking_users_ids = await self._fetch_staking_users_ids()
+        drift = len(staking_users_ids.symmetric_difference(self.staking_users_ids))
+        if drift:
+            logging.warning(f":::hodl_bot: staking registry drifted from database by {drift} users")
+        self.staking_users_ids = staking_users_ids
+        self.is_loaded = True
+        return drift
+
+    async def _fetch_staking_users_ids(self) -> Set[int]:
+        """Staking users from database with changes made while the query was running re-applied on top"""
+        self._changes_during_reconcile = {}
+        try:
+            staking_users_ids = set(await User.filter(is_staking=True).values_list("id", flat=True))
+        finally:
+            changes, self._changes_during_reconcile = self._changes_during_reconcile, None
+        for user_id, is_staking in changes.items():
+            if is_staking:
+                staking_users_ids.add(user_id)
+            else:
+                staking_users_ids.discard(user_id)
+        return staking_users_ids
+
+    def set_staking(self, user_id: int, is_staking: bool) -> None:
+        if is_staking:
+            self.staking_users_ids.add(user_id)
+        else:
+            self.staking_users_ids.discard(user_id)
+        if self._changes_during_reconcile is not None:
+            self._changes_during_reconcile[user_id] = is_staking
+
+    def is_staking(self, user_id: int) -> bool:
+        if user_id in self.staking_users_ids:
+            self.hits += 1
+            STAKING_REGISTRY_LOOKUPS.inc("hit")
+            return True
+        self.misses += 1
+        STAKING_REGISTRY_LOOKUPS.inc("miss")
+        return False
+
+    def filter_staking(self, users_ids: Iterable[int]) -> List[int]:
+        return [user_id for user_id in users_ids if self.is_staking(user_id)]
+
+    def stats(self) -> dict:
+        return {"staking_users_count": len(self.staking_users_ids), "hits": self.hits, "misses": self.misses}
+
+
+class EpochProvider:
+    """Keeps the latest epochs in memory, EpochCog updates it whenever it creates a new epoch"""
+
+    # the latest epoch and the one before it, the next epoch is created before the current one ends
+    CACHED_EPOCHS_COUNT = 2
+
+    def __init__(self):
+        self.epochs: List[Epoch] = []  # ordered by id, the latest epoch is the last one
+
+    async def refresh(self) -> None:
+        self.epochs = list(reversed(await Epoch.all().order_by("-id").limit(self.CACHED_EPOCHS_COUNT)))
+
+    def add(self, epoch: Epoch) -> None:
+        epochs = [*self.epochs, epoch]
+        start = max(len(epochs) - self.CACHED_EPOCHS_COUNT, 0)
+        self.epochs = epochs[start:]
+
+    async def get_current(self) -> Optional[Epoch]:
+        if not self.epochs:
+            await self.refresh()
+        return self.epochs[-1] if self.epochs else None
+
+    async def get_open_epochs(self, at: datetime.datetime) -> List[Epoch]:
+        """
+        Epochs which balance moves at given time count towards: the ones which already exist and haven't ended yet.
+        Usually it's only the current epoch, but near the end of the epoch the next one already exists.
+        """
+        if not self.epochs:
+            await self.refresh()
+        if not self.epochs:
+            return []
+        if at < self.epochs[0].created_at:
+            # event is older than cached epochs (e.g. it's replayed), fall back to database
+            return await Epoch.filter(created_at__lte=at, end_datetime__gte=at).order_by("id")
+        open_epochs = [epoch for epoch in self.epochs if epoch.created_at <= at <= epoch.end_datetime]
+        # if the next epoch is late, keep counting towards the latest one
+        return open_epochs or [self.epochs[-1]]
+
+
+class RecentMessagesIds:
+    """Bounded set of recently seen messages ids, the oldest ids are evicted first"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._ids: "OrderedDict[int, None]" = OrderedDict()
+
+    def add(self, message_id: int) -> bool:
+        """Remember message id, returns False if it was already seen"""
+        if message_id in self._ids:
+            self._ids.move_to_end(message_id)
+            return False
+        self._ids[message_id] = None
+        if len(self._ids) > self.maxsize:
+            self._ids.popitem(last=False)
+        return True
+
+    def __contains__(self, message_id: int) -> bool:
+        return message_id in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
@@ -1,7 +1,41 @@
+from decimal import Decimal
+
 EPOCH_DURATION_IN_DAYS = 14
 SPACE_BETWEEN_EPOCHS_IN_SECONDS = 42
-CHECK_EPOCH_IN_MINUTES = 15
-DEFAULT_EPOCH_APY = 0.05  # APY per epoch in % (aka 0.05 means 5%)
-DEFAULT_PORTFOLIO_PERCENTAGE = 0.2  # part of the User.balance which will be staked
+CHECK_EPOCH_IN_MINUTES = 15  # epoch job is scheduled at epoch boundaries, but runs at least this often
+NEXT_EPOCH_LEAD_TIME_IN_MINUTES = 30  # next epoch is created this long before the current one ends
+# epoch is settled once points log is processed this far past its end, late events can't change rewards after that
+SETTLEMENT_GRACE_PERIOD_IN_MINUTES = 5
+DEFAULT_EPOCH_APY = Decimal("0.05")  # APY per epoch in % (aka 0.05 means 5%)
+DEFAULT_PORTFOLIO_PERCENTAGE = Decimal("0.2")  # part of the User.balance which will be staked
 GENESIS_EPOCH_ID = 1
 PENALTIES_FREE_DAYS_FOR_GENESIS = 2  # during this time we won't penalise users when they begin staking
+POINTS_LOG_FLUSH_INTERVAL_IN_MS = 250  # how long points log events are buffered before they are written to database
+POINTS_LOG_BATCH_SIZE = 500  # flush points log events earlier if this many of them are buffered
+POINTS_LOG_RETRY_BACKOFF_IN_SECONDS = 1  # failed points log batches are retried after this, doubled every time
+POINTS_LOG_MAX_RETRY_BACKOFF_IN_SECONDS = 60
+POINTS_LOG_REPLAY_RETRY_IN_SECONDS = 60  # channel history replay which failed is retried after this
+POINTS_LOG_DUMP_MAX_RETRIES = 5  # replay of exported points log gives up on batches which still fail after this
+POINTS_LOG_IDLE_CHECKPOINT_IN_SECONDS = 60  # how often high water mark follows time while points log is quiet
+POINTS_LOG_IDLE_CHECKPOINT_LAG_IN_SECONDS = 120  # messages older than this are received, unless bot is disconnected
+STAKING_REGISTRY_RECONCILE_IN_MINUTES = 10  # how often in-memory set of staking users is synced with database
+ACCOUNTANT_COALESCE_WINDOW_IN_MS = 20  # balance lookups which arrive within this window are sent as one request
+ACCOUNTANT_BALANCES_CHUNK_SIZE = 100  # max amount of ids sent in one /balances request
+ACCOUNTANT_REQUEST_TIMEOUT_IN_SECONDS = 5
+ACCOUNTANT_MAX_RETRIES = 3
+ACCOUNTANT_RETRY_BACKOFF_IN_SECONDS = 0.5  # doubled after every failed attempt
+ACCOUNTANT_BALANCE_CACHE_TTL_IN_SECONDS = 5  # so repeated button clicks don't trigger repeated requests
+ACCOUNTANT_MAX_CONNECTIONS = 10
+ACCOUNTANT_MAX_CONCURRENT_REQUESTS = 4  # max amount of /balances requests in flight at the same time
+RECONCILE_BALANCES_IN_MINUTES = 60
+RECONCILE_BALANCES_CHUNK_SIZE = 500  # staking users loaded and corrected at once
+RECONCILE_BALANCES_CHUNK_DELAY_IN_SECONDS = 1  # pause between chunks, so reconciliation doesn't hammer API or DB
+REWARDS_REPORT_CHUNK_SIZE = 10_000  # rewards loaded from database at once while writing report
+REWARDS_REPORT_MAX_ROWS_PER_FILE = 100_000  # keeps every report attachment below discord's upload limit
+RECENT_MESSAGES_IDS_CACHE_SIZE = 100_000  # ids of recently processed points log messages kept for deduplication
+LEADER_ELECTION_INTERVAL_IN_SECONDS = 5  # how often followers try to take over and the leader checks its lock
+DM_REPLY_DEBOUNCE_IN_SECONDS = 2  # DMs of the same user within this window get one reply
+DM_SEND_RATE_PER_SECOND = 10  # stays well below Discord's global rate limit of 50 requests per second
+DM_SEND_QUEUE_MAX_SIZE = 10_000  # replies over this are dropped instead of piling up in memory
+STATS_PAGE_SIZE = 10  # epochs shown per page of admin stats commands
+SHUTDOWN_DRAIN_TIMEOUT_IN_SECONDS = 10  # queued work which isn't done by then is saved or dropped, see Lifecycle
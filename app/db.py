@@ -0,0 +1,137 @@
+"""
+Tortoise engine which is the same as tortoise.backends.asyncpg but counts and times every query
+and every wait for a free pool connection, waits are limited by "acquire_timeout" credential.
+Enabled via "engine": "app.db" in TORTOISE_ORM.
+"""
+import time
+import asyncio
+from functools import wraps
+from typing import Any, Optional
+
+import asyncpg
+from tortoise.transactions import current_transaction_map
+from tortoise.exceptions import DBConnectionError, TransactionManagementError
+from tortoise.backends.base.client import TransactionContextPooled
+from tortoise.backends.asyncpg.client import AsyncpgDBClient, TransactionWrapper
+
+from app.metrics import (
+    current_handler,
+    DB_QUERIES,
+    DB_QUERY_DURATION,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_IN_USE,
+    DB_POOL_WAITING,
+    DB_POOL_WAIT_DURATION,
+    DB_POOL_ACQUIRE_TIMEOUTS,
+)
+
+
+def get_connection_credentials(credentials: dict) -> dict:
+    """Credentials understood by asyncpg.connect, for dedicated connections outside of the pool"""
+    return {key: credentials[key] for key in ("host", "port", "user", "password", "database")}
+
+
+def instrumented(func):
+    @wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        handler = current_handler.get()
+        started_at = time.perf_counter()
+        try:
+            return await func(self, *args, **kwargs)
+        finally:
+            DB_QUERIES.inc(handler)
+            DB_QUERY_DURATION.observe(time.perf_counter() - started_at, handler)
+
+    return wrapper
+
+
+async def acquire(pool: asyncpg.pool.Pool, timeout: Optional[float]) -> asyncpg.Connection:
+    handler = current_handler.get()
+    DB_POOL_WAITING.inc()
+    started_at = time.perf_counter()
+    try:
+        connection = await pool.acquire(timeout=timeout)
+    except asyncio.TimeoutError:
+        DB_POOL_ACQUIRE_TIMEOUTS.inc(handler)
+        raise DBConnectionError(f"Timed out after {timeout}s waiting for a free database connection")
+    finally:
+        DB_POOL_WAITING.dec()
+        DB_POOL_WAIT_DURATION.observe(time.perf_counter() - started_at, handler)
+    DB_POOL_IN_USE.inc()
+    return connection
+
+
+async def release(pool: asyncpg.pool.Pool, connection: asyncpg.Connection) -> None:
+    try:
+        await pool.release(connection)
+    finally:
+        DB_POOL_IN_USE.dec()
+
+
+class InstrumentedPoolConnectionWrapper:
+    def __init__(self, pool: asyncpg.pool.Pool, timeout: Optional[float]):
+        self.pool = pool
+        self.timeout = timeout
+        self.connection = None
+
+    async def __aenter__(self) -> asyncpg.Connection:
+        self.connection = await acquire(self.pool, self.timeout)
+        return self.connection
+
+    async def __aexit__(self, exc_type: Any, exc_val: Any, exc_tb: Any) -> None:
+        await release(self.pool, self.connection)
+
+
+class InstrumentedTransactionContextPooled(TransactionContextPooled):
+    """Same as TransactionContextPooled but connection is acquired and released via instrumented helpers"""
+
+    async def __aenter__(self):
+        parent = self.connection._parent
+        self.connection._connection = await acquire(parent._pool, parent.acquire_timeout)
+        self.token = current_transaction_map[self.connection_name].set(self.connection)
+        await self.connection.start()
+        return self.connection
+
+    async def __aexit__(self, exc_type: Any, exc_val: Any, exc_tb: Any) -> None:
+        parent = self.connection._parent
+        try:
+            if not self.connection._finalized:
+                if exc_type:
+                    # can't rollback a transaction that already failed
+                    if exc_type is not TransactionManagementError:
+                        await self.connection.rollback()
+                else:
+                    await self.connection.commit()
+        finally:
+            current_transaction_map[self.connection_name].reset(self.token)
+            if parent._pool:
+                await release(parent._pool, self.connection._connection)
+
+
+class InstrumentedQueriesMixin:
+    execute_insert = instrumented(AsyncpgDBClient.execute_insert)
+    execute_query = instrumented(AsyncpgDBClient.execute_query)
+    execute_query_dict = instrumented(AsyncpgDBClient.execute_query_dict)
+    execute_script = instrumented(AsyncpgDBClient.execute_script)
+
+
+class InstrumentedTransactionWrapper(InstrumentedQueriesMixin, TransactionWrapper):
+    execute_many = instrumented(TransactionWrapper.execute_many)
+
+
+class InstrumentedAsyncpgDBClient(InstrumentedQueriesMixin, AsyncpgDBClient):
+    execute_many = instrumented(AsyncpgDBClient.execute_many)
+
+    def __init__(self, *args: Any, acquire_timeout: Optional[float] = None, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.acquire_timeout = acquire_timeout
+        DB_POOL_MAX_SIZE.set(self.pool_maxsize)
+
+    def acquire_connection(self) -> InstrumentedPoolConnectionWrapper:
+        return InstrumentedPoolConnectionWrapper(self._pool, self.acquire_timeout)
+
+    def _in_transaction(self) -> InstrumentedTransactionContextPooled:
+        return InstrumentedTransactionContextPooled(InstrumentedTransactionWrapper(self))
+
+
+client_class = InstrumentedAsyncpgDBClient
@@ -1,15 +1,23 @@
 import logging
 import asyncio
+import pathlib
 import datetime
+import tempfile
+from typing import Optional
 
+import discord
 from tortoise import timezone
-from discord.ext import commands, tasks
-from tortoise.transactions import in_transaction
+from discord.ext import commands
 from sentry_sdk import capture_exception, Hub
 
-from app.models import Epoch, UserEpoch, User
-from app.constants import CHECK_EPOCH_IN_MINUTES
-from app.utils import generate_start_datetime_for_latest_epoch, generate_end_datetime_for_latest_epoch
+import config
+from app.metrics import timed
+from app.models import Epoch
+from app.replay import get_high_water_mark
+from app.notifications import notify_epoch_created
+from app.constants import CHECK_EPOCH_IN_MINUTES, NEXT_EPOCH_LEAD_TIME_IN_MINUTES, SETTLEMENT_GRACE_PERIOD_IN_MINUTES
+from app.settlement import settle_epoch, get_epoch_rewards_summary, write_rewards_report
+from app.utils import create_genesis_epoch, create_next_epoch, pp_points
 
 
 class EpochCog(commands.Cog):
@@ -17,67 +25,119 @@ class EpochCog(commands.Cog):
 
     def __init__(self, bot: commands.Bot):
         self.bot: commands.Bot = bot
-        self.epoch_cron_task_lock = asyncio.Lock()
-        self.epoch_cron_task.start()
+        self.epoch_scheduler_task = self.bot.loop.create_task(self.epoch_scheduler())
 
     def cog_unload(self):
-        self.epoch_cron_task.cancel()
-
-    @tasks.loop(minutes=CHECK_EPOCH_IN_MINUTES)
-    async def epoch_cron_task(self):
-        with Hub(Hub.current):
-            # ensure that only one instance of job is running, other instances will be discarded
-            if not self.epoch_cron_task_lock.locked():
-                await self.epoch_cron_task_lock.acquire()
+        self.epoch_scheduler_task.cancel()
+
+    async def epoch_scheduler(self) -> None:
+        """Run epoch job on the leader replica right when the next epoch is due or the current one ends"""
+        await self.bot.wait_until_ready()
+        await self.bot.lifecycle.wait_until_warmed_up()
+        sync_discord = self.bot.get_cog("SyncDiscordCog")
+        if sync_discord is not None:
+            # epochs don't roll over while events which happened before are still being caught up with
+            await sync_discord.wait_until_caught_up()
+        while True:
+            await self.bot.leader_election.wait_until_leader()
+            # retry later if anything below fails, e.g. database isn't reachable
+            next_run_at = timezone.now() + datetime.timedelta(minutes=CHECK_EPOCH_IN_MINUTES)
+            with Hub(Hub.current):
                 try:
-                    await self.check_increment_epoch()
+                    with timed("epochs.check_increment_epoch"):
+                        await self.check_increment_epoch()
+                    with timed("epochs.settle_ended_epochs"):
+                        await self.settle_ended_epochs()
+                    next_run_at = await self.get_next_run_at()
                 except Exception as e:
-                    logging.debug(f":::hodl_bot: {e}")
+                    logging.error(f":::hodl_bot: {e}")
                     capture_exception(e)
-                finally:
-                    self.epoch_cron_task_lock.release()
+            await asyncio.sleep(max((next_run_at - timezone.now()).total_seconds(), 1))
 
-    @epoch_cron_task.before_loop
-    async def before_epoch_cron_task(self):
-        await self.bot.wait_until_ready()
+    async def get_next_run_at(self) -> datetime.datetime:
+        now = timezone.now()
+        # fallback in case epochs were changed by hand or a job failed
+        next_run_at = now + datetime.timedelta(minutes=CHECK_EPOCH_IN_MINUTES)
+        latest_epoch = await self.bot.epoch_provider.get_current()
+        if not latest_epoch:
+            return next_run_at
+        due_times = [
+            latest_epoch.end_datetime - datetime.timedelta(minutes=NEXT_EPOCH_LEAD_TIME_IN_MINUTES),
+            *[self.get_settle_at(epoch) for epoch in self.bot.epoch_provider.epochs],
+        ]
+        return min([due_time for due_time in due_times if due_time > now] + [next_run_at])
 
     async def check_increment_epoch(self) -> None:
         """Always keep current epoch in database, increment epoch if needed"""
-        latest_epoch = await Epoch.all().order_by("-id").first()
+        latest_epoch = await self.bot.epoch_provider.get_current()
         if not latest_epoch:
             # init genesis epoch
-            await Epoch.create(
-                start_datetime=generate_start_datetime_for_latest_epoch(),
-                end_datetime=generate_end_datetime_for_latest_epoch(),
-            )
+            genesis_epoch = await create_genesis_epoch()
+            await self.on_epoch_created(genesis_epoch)
             return None
         # check if latest epoch end date isn't too close and if it is generate subsequent epoch
         is_too_close = (
-            latest_epoch.end_datetime - datetime.timedelta(minutes=2 * CHECK_EPOCH_IN_MINUTES) < timezone.now()
+            latest_epoch.end_datetime - datetime.timedelta(minutes=NEXT_EPOCH_LEAD_TIME_IN_MINUTES) <= timezone.now()
         )
         if is_too_close:
-            # create next epoch and it's UserEpoch for all users
-            # (if user is staking epoch_lowest_balance = balance else epoch_lowest_balance = 0)
-            async with in_transaction():
-                new_epoch = await Epoch.create(
-                    start_datetime=generate_start_datetime_for_latest_epoch(latest_epoch),
-                    end_datetime=generate_end_datetime_for_latest_epoch(latest_epoch),
-                )
-
-                # handle UserEpoch for staking users
-                staking_users = await User.filter(is_staking=True)
-                # create UserEpoch for staking users
-                await UserEpoch.bulk_create(
-                    [UserEpoch(user=user, epoch=new_epoch, epoch_lowest_balance=user.balance) for user in staking_users]
-                )
-
-                # handle UserEpoch for non staking users
-                non_staking_users = await User.filter(is_staking=False)
-                # create UserEpoch for non staking users
-                await UserEpoch.bulk_create(
-                    [UserEpoch(user=user, epoch=new_epoch, epoch_lowest_balance=0) for user in non_staking_users]
-                )
+            # create next epoch and it's UserEpoch for all staking users
+            new_epoch = await create_next_epoch(latest_epoch)
+            await self.on_epoch_created(new_epoch)
+            return None
+
+    async def on_epoch_created(self, epoch: Optional[Epoch]) -> None:
+        if epoch is None:
+            # another replica was faster
+            await self.bot.epoch_provider.refresh()
+            return None
+        # make new epoch visible to other cogs only after it was committed
+        self.bot.epoch_provider.add(epoch)
+        await notify_epoch_created(epoch)
+
+    @staticmethod
+    def get_settle_at(epoch: Epoch) -> datetime.datetime:
+        return epoch.end_datetime + datetime.timedelta(minutes=SETTLEMENT_GRACE_PERIOD_IN_MINUTES)
+
+    @staticmethod
+    async def get_points_log_processed_until() -> Optional[datetime.datetime]:
+        """Points log events posted before this time are applied, it's the time of the high water mark message"""
+        high_water_mark = await get_high_water_mark()
+        if high_water_mark is None:
+            return None
+        return discord.utils.snowflake_time(high_water_mark).replace(tzinfo=datetime.timezone.utc)
+
+    async def settle_ended_epochs(self) -> None:
+        """Calculate rewards for ended epochs and DM rewards report to admins"""
+        ended_epochs = await Epoch.filter(end_datetime__lt=timezone.now(), reported_at=None).order_by("id")
+        if not ended_epochs:
             return None
+        processed_until = await self.get_points_log_processed_until()
+        for epoch in ended_epochs:
+            # events which happened before the epoch ended can be queued or waiting for replay, they lower rewards
+            if processed_until is None or processed_until < self.get_settle_at(epoch):
+                logging.info(f":::hodl_bot: {epoch} is settled once points log is processed past its end")
+                return None
+            # until rewards are reported they are recalculated, so they include events applied since the last run
+            await settle_epoch(epoch)
+            await self.send_rewards_report(epoch)
+            epoch.reported_at = timezone.now()
+            await epoch.save(update_fields=["reported_at", "modified_at"])
+
+    async def send_rewards_report(self, epoch: Epoch) -> None:
+        summary = await get_epoch_rewards_summary(epoch)
+        content = f"{epoch} has ended.\nStakers: `{summary['users_count']}`\nStaked Points: `{pp_points(summary['staked_points'])}`{config.POINTS_EMOJI}\nRewards: `{pp_points(summary['reward'])}`{config.POINTS_EMOJI}"  # noqa: E501
+        with tempfile.TemporaryDirectory(prefix="hodl_bot_rewards_") as directory:
+            paths = await write_rewards_report(epoch, pathlib.Path(directory))
+            for admin_id in config.ADMIN_USERS_IDS:
+                # one admin with closed DMs (or who left) shouldn't make the report to be re-sent to everybody
+                try:
+                    admin = self.bot.get_user(admin_id) or await self.bot.fetch_user(admin_id)
+                    await admin.send(content)
+                    for path in paths:
+                        await admin.send(file=discord.File(path))
+                except discord.HTTPException as e:
+                    logging.warning(f":::hodl_bot: failed to send {epoch} rewards report to admin {admin_id}: {e}")
+                    capture_exception(e)
 
 
 def setup(bot):
@@ -1,27 +1,52 @@
+import asyncio
+import logging
 import datetime
+from decimal import Decimal
+from typing import Dict
 
 import discord
-from tortoise import timezone
+from tortoise import Tortoise, timezone
 from discord.ext import commands
+from sentry_sdk import capture_exception
+from tortoise.transactions import in_transaction
 from discord_slash import cog_ext
-from tortoise.query_utils import Q
 from discord_slash.model import ButtonStyle
 from discord_slash.context import ComponentContext
 from discord_slash.utils.manage_components import create_button, create_actionrow
 
-from app.models import User, UserEpoch, Epoch
+from app.models import Epoch
+from app.sending import SendQueue
+from app.metrics import instrument, DM_COALESCED_MESSAGES
+from app.notifications import notify_staking_changed
+from app.queries import (
+    SELECT_USER_STAKING_INFO,
+    UPSERT_USER_STAKING,
+    INSERT_MISSING_USER_EPOCHS,
+    RESET_USER_EPOCH_LOWEST_BALANCE,
+)
 from config import SHOULD_STAKE_AFTER_FIRST_EPOCH, PROJECT_NAME
-from app.utils import ensure_registered, get_user_balance, display_staking_info
-from app.constants import GENESIS_EPOCH_ID, PENALTIES_FREE_DAYS_FOR_GENESIS
+from app.utils import display_staking_info
+from app.constants import GENESIS_EPOCH_ID, PENALTIES_FREE_DAYS_FOR_GENESIS, DM_REPLY_DEBOUNCE_IN_SECONDS
 
 
 class OnboardingCog(commands.Cog):
     """Cog which is resposible for onboarding new users into staking world"""
 
-    def __init__(self, bot: commands.Bot):
+    def __init__(self, bot: commands.Bot, reply_debounce_in_seconds: float = DM_REPLY_DEBOUNCE_IN_SECONDS):
         self.bot: commands.Bot = bot
+        self.reply_debounce = reply_debounce_in_seconds
+        self.pending_replies: Dict[int, asyncio.Task] = {}  # user id -> reply which isn't sent yet
+        # replies are sent in the background at a pace Discord accepts, see SendQueue
+        self.send_queue = SendQueue()
+        self.send_queue_task = self.bot.loop.create_task(self.send_queue.run())
+
+    def cog_unload(self):
+        self.send_queue_task.cancel()
+        for reply in self.pending_replies.values():
+            reply.cancel()
 
     @commands.Cog.listener()
+    @instrument("onboarding.on_message")
     async def on_message(self, message: discord.Message) -> None:
         # ignore bot's own messages
         if message.author == self.bot.user:
@@ -29,24 +54,55 @@ class OnboardingCog(commands.Cog):
         # allow only messages from DM
         if message.guild:
             return None
-        # check if users is already staking
-        is_already_staking = await User.exists(Q(id=message.author.id) & Q(is_staking=True))
+        # replicas which aren't the leader stay idle, so users get only one reply
+        if not self.bot.leader_election.is_leader:
+            return None
+        # a burst of DMs gets one reply which is built when the burst is over
+        if message.author.id in self.pending_replies:
+            DM_COALESCED_MESSAGES.inc()
+            return None
+        # the task inherits handler context, so its queries are attributed to on_message
+        self.pending_replies[message.author.id] = asyncio.ensure_future(self.reply_later(message))
+
+    async def reply_later(self, message: discord.Message) -> None:
+        try:
+            await asyncio.sleep(self.reply_debounce)
+            await self.bot.lifecycle.wait_until_warmed_up()
+            await self.reply(message)
+        except Exception as e:
+            logging.error(f":::hodl_bot: {e}")
+            capture_exception(e)
+        finally:
+            del self.pending_replies[message.author.id]
+
+    async def drain(self) -> None:
+        """Wait until all pending replies are built and queued for sending"""
+        while self.pending_replies:
+            await asyncio.gather(*self.pending_replies.values())
+
+    async def reply(self, message: discord.Message) -> None:
+        current_epoch = await self.bot.epoch_provider.get_current()
+        # user, staking status and balance of the current epoch in one round-trip
+        users = await Tortoise.get_connection("default").execute_query_dict(
+            SELECT_USER_STAKING_INFO, [message.author.id, current_epoch.id if current_epoch else None]
+        )
+        is_already_staking = bool(users) and users[0]["is_staking"]
         if is_already_staking:
             buttons = [
                 create_button(style=ButtonStyle.red, label="Yes", custom_id="continue_staking_no"),
                 create_button(style=ButtonStyle.blue, label="No", custom_id="continue_staking_yes"),
             ]
             action_row = create_actionrow(*buttons)
-            user = await User.get(id=message.author.id)
-            current_epoch = await Epoch.all().order_by("-id").first()
             is_epoch_genesis = current_epoch.id == GENESIS_EPOCH_ID
             if not is_epoch_genesis and not SHOULD_STAKE_AFTER_FIRST_EPOCH:
-                return await message.channel.send("Earned points will be distributed soon")
-            user_epoch = await UserEpoch.get(user_id=user.id, epoch_id=current_epoch.id)
-            return await message.channel.send(
+                self.send_queue.put(message.channel, "Earned points will be distributed soon")
+                return None
+            epoch_lowest_balance = users[0]["epoch_lowest_balance"]
+            self.send_queue.put(
+                message.channel,
                 display_staking_info(
-                    points=user.balance,
-                    epoch_lowest_balance=user_epoch.epoch_lowest_balance,
+                    points=users[0]["balance"],
+                    epoch_lowest_balance=epoch_lowest_balance if epoch_lowest_balance is not None else Decimal(0),
                     current_epoch=current_epoch,
                 )
                 # + "\n\nDo you want to stop staking?",
@@ -58,16 +114,18 @@ class OnboardingCog(commands.Cog):
                 create_button(style=ButtonStyle.blue, label="No", custom_id="start_staking_no"),
             ]
             action_row = create_actionrow(*buttons)
-            return await message.channel.send(f"Do you want to stake {PROJECT_NAME} points?", components=[action_row])
+            self.send_queue.put(
+                message.channel, f"Do you want to stake {PROJECT_NAME} points?", components=[action_row]
+            )
 
     @cog_ext.cog_component(components=["start_staking_yes"])
+    @instrument("onboarding.choose_staking_yes")
     async def choose_staking_yes(self, ctx: ComponentContext) -> None:
-        await ensure_registered(ctx.author.id)
-        points = await get_user_balance(ctx.author.id)
-        await User.filter(id__in=[ctx.author.id]).update(
-            balance=points, is_staking=True, staking_started_date=timezone.now()
-        )
-        current_epoch = await Epoch.all().order_by("-id").first()
+        if not self.bot.leader_election.is_leader:
+            return None
+        await self.bot.lifecycle.wait_until_warmed_up()
+        points = await self.bot.accountant.get_balance(ctx.author.id)
+        current_epoch = await self.bot.epoch_provider.get_current()
         penalties_free = (
             current_epoch.id == GENESIS_EPOCH_ID
             and current_epoch.start_datetime + datetime.timedelta(days=PENALTIES_FREE_DAYS_FOR_GENESIS)
@@ -76,35 +134,65 @@ class OnboardingCog(commands.Cog):
         if penalties_free:
             # allow to stake for genesis epoch without penalties during the first day
             epoch_lowest_balance = points
-        elif not SHOULD_STAKE_AFTER_FIRST_EPOCH:
+        else:
+            # in current epoch user's staking balance will be zero
+            # if you started staking in between epochs your stake will be counted from the next epoch
+            epoch_lowest_balance = 0
+        # UserEpoch rows exist before points log sees the user staking, otherwise it creates them from the whole balance
+        async with in_transaction() as connection:
+            await connection.execute_query(UPSERT_USER_STAKING, [ctx.author.id, points, True, timezone.now()])
+            await self.insert_missing_user_epochs(connection, ctx.author.id, current_epoch, epoch_lowest_balance)
+        self.bot.staking_registry.set_staking(ctx.author.id, True)
+        await notify_staking_changed(ctx.author.id, True)
+        if not penalties_free and not SHOULD_STAKE_AFTER_FIRST_EPOCH:
             await ctx.edit_origin(
                 content="I'm sorry but you can't begin staking right now.",
                 components=[],
             )
             return None
-        else:
-            # in current epoch user's staking balance will be zero
-            # if you started staking in between epochs your stake will be counted from the next epoch
-            epoch_lowest_balance = 0
         await ctx.edit_origin(
             content=f"Good. Your points will be staked. Please note that {current_epoch.portfolio_percentage * 100}% of your balance will be staked. To be eligible for rewards you need to HODL points. After 2 weeks you are expected to earn {current_epoch.apy * 100}%. If you started staking in between epochs your stake will be counted from the next epoch.\n\n{display_staking_info(points=points, epoch_lowest_balance=epoch_lowest_balance, current_epoch=current_epoch)}",  # noqa: E501
             components=[],
         )
-        await UserEpoch.get_or_create(
-            user_id=ctx.author.id, epoch_id=current_epoch.id, defaults={"epoch_lowest_balance": epoch_lowest_balance}
-        )
         return None
 
+    async def insert_missing_user_epochs(
+        self, connection, user_id: int, current_epoch: Epoch, epoch_lowest_balance: Decimal
+    ) -> None:
+        """
+        Missing UserEpoch would be created by points log from the whole balance,
+        so epochs which are still open and the user can't stake in get a zero row.
+        """
+        open_epochs = await self.bot.epoch_provider.get_open_epochs(timezone.now())
+        epochs_ids = [epoch.id for epoch in open_epochs if epoch.id != current_epoch.id]
+        await connection.execute_query(
+            INSERT_MISSING_USER_EPOCHS,
+            [
+                [user_id] * (len(epochs_ids) + 1),
+                [*epochs_ids, current_epoch.id],
+                [*[0] * len(epochs_ids), epoch_lowest_balance],
+            ],
+        )
+
     @cog_ext.cog_component(components=["start_staking_no", "continue_staking_no"])
+    @instrument("onboarding.choose_staking_no")
     async def choose_staking_no(self, ctx: ComponentContext):
+        if not self.bot.leader_election.is_leader:
+            return None
+        await self.bot.lifecycle.wait_until_warmed_up()
         await ctx.edit_origin(content="You choose to not receive APY, have a nice day.", components=[])
-        await ensure_registered(ctx.author.id)
-        await User.filter(id__in=[ctx.author.id]).update(is_staking=False, staking_started_date=None)
-        current_epoch = await Epoch.all().order_by("-id").first()
-        await UserEpoch.filter(user_id=ctx.author.id, epoch_id=current_epoch.id).update(epoch_lowest_balance=0)
+        connection = Tortoise.get_connection("default")
+        await connection.execute_query(UPSERT_USER_STAKING, [ctx.author.id, None, False, None])
+        self.bot.staking_registry.set_staking(ctx.author.id, False)
+        await notify_staking_changed(ctx.author.id, False)
+        current_epoch = await self.bot.epoch_provider.get_current()
+        await connection.execute_query(RESET_USER_EPOCH_LOWEST_BALANCE, [ctx.author.id, current_epoch.id])
 
     @cog_ext.cog_component()
+    @instrument("onboarding.continue_staking_yes")
     async def continue_staking_yes(self, ctx: ComponentContext):
+        if not self.bot.leader_election.is_leader:
+            return None
         await ctx.edit_origin(content="You choose to continue staking, have a nice day.", components=[])
 
 
@@ -0,0 +1,123 @@
+import logging
+import asyncio
+from decimal import Decimal
+from typing import Dict, List
+
+from tortoise import Tortoise, timezone
+from discord.ext import commands, tasks
+from tortoise.transactions import in_transaction
+from sentry_sdk import capture_exception, Hub
+
+from app.metrics import timed
+from app.models import JobCheckpoint
+from app.queries import UPDATE_RECONCILED_BALANCES, SELECT_STAKING_USERS_AFTER
+from app.constants import (
+    RECONCILE_BALANCES_IN_MINUTES,
+    RECONCILE_BALANCES_CHUNK_SIZE,
+    RECONCILE_BALANCES_CHUNK_DELAY_IN_SECONDS,
+)
+
+
+RECONCILE_BALANCES_CHECKPOINT = "reconcile_balances_last_user_id"
+
+
+class ReconciliationCog(commands.Cog):
+    """Cog which is responsible for re-syncing staking users balances with The Accountant"""
+
+    def __init__(self, bot: commands.Bot):
+        self.bot: commands.Bot = bot
+        self.reconcile_cron_task_lock = asyncio.Lock()
+        # user_id -> real balance - balance of drifted users seen by the previous and by the current pass
+        self.suspected_drifts: Dict[int, Decimal] = {}
+        self.next_suspected_drifts: Dict[int, Decimal] = {}
+        self.reconcile_cron_task.start()
+
+    def cog_unload(self):
+        self.reconcile_cron_task.cancel()
+
+    @tasks.loop(minutes=RECONCILE_BALANCES_IN_MINUTES)
+    async def reconcile_cron_task(self):
+        with Hub(Hub.current):
+            # ensure that only one instance of job is running, other instances will be discarded
+            if not self.bot.leader_election.is_leader:
+                return None
+            if not self.reconcile_cron_task_lock.locked():
+                await self.reconcile_cron_task_lock.acquire()
+                try:
+                    with timed("reconciliation.reconcile_balances"):
+                        await self.reconcile_balances()
+                except Exception as e:
+                    logging.error(f":::hodl_bot: {e}")
+                    capture_exception(e)
+                finally:
+                    self.reconcile_cron_task_lock.release()
+
+    @reconcile_cron_task.before_loop
+    async def before_reconcile_cron_task(self):
+        await self.bot.wait_until_ready()
+        await self.bot.lifecycle.wait_until_warmed_up()
+
+    async def reconcile_balances(self) -> None:
+        """Walk over staking users in chunks, resuming from the last processed user after restart"""
+        checkpoint = await JobCheckpoint.get_or_none(name=RECONCILE_BALANCES_CHECKPOINT)
+        last_user_id = int(checkpoint.value) if checkpoint else 0
+        corrected_count = 0
+        while True:
+            if not self.bot.leader_election.is_leader:
+                # the new leader will resume from the checkpoint
+                return None
+            users = await Tortoise.get_connection("default").execute_query_dict(
+                SELECT_STAKING_USERS_AFTER, [last_user_id, RECONCILE_BALANCES_CHUNK_SIZE]
+            )
+            if not users:
+                break
+            corrected_count += await self.reconcile_chunk(users)
+            last_user_id = users[-1]["id"]
+            await JobCheckpoint.update_or_create(
+                name=RECONCILE_BALANCES_CHECKPOINT, defaults={"value": str(last_user_id)}
+            )
+            await asyncio.sleep(RECONCILE_BALANCES_CHUNK_DELAY_IN_SECONDS)
+        # full pass is done, next one starts from the beginning
+        await JobCheckpoint.filter(name=RECONCILE_BALANCES_CHECKPOINT).delete()
+        # drifts of users who weren't seen by this pass (e.g. they stopped staking) are forgotten
+        self.suspected_drifts, self.next_suspected_drifts = self.next_suspected_drifts, {}
+        logging.info(f":::hodl_bot: balances reconciliation finished, corrected {corrected_count} users")
+
+    async def reconcile_chunk(self, users: List[dict]) -> int:
+        """
+        Apply real balances to users whose balance drifted, returns amount of corrected users.
+        Real balance already includes points sent whose points log messages aren't applied yet (or even posted),
+        correcting them right away would subtract them twice. So users are corrected only once the next pass
+        finds the same difference between the balances: points moved in between change both of them alike,
+        while an event which was pending on the previous pass has closed the difference by now.
+        """
+        real_balances = await self.bot.accountant.get_balances(user["id"] for user in users)
+        drifted_users = []
+        for user in users:
+            user_id = user["id"]
+            drift = real_balances[user_id] - user["balance"]
+            previous_drift = self.suspected_drifts.pop(user_id, None)
+            if not drift:
+                continue
+            if drift == previous_drift:
+                drifted_users.append(user)
+            else:
+                self.next_suspected_drifts[user_id] = drift
+        if not drifted_users:
+            return 0
+        open_epochs = await self.bot.epoch_provider.get_open_epochs(timezone.now())
+        async with in_transaction() as connection:
+            await connection.execute_query(
+                UPDATE_RECONCILED_BALANCES,
+                [
+                    [user["id"] for user in drifted_users],
+                    [real_balances[user["id"]] for user in drifted_users],
+                    [user["balance"] for user in drifted_users],
+                    [epoch.id for epoch in open_epochs],
+                ],
+            )
+        return len(drifted_users)
+
+
+def setup(bot):
+    bot.add_cog(ReconciliationCog(bot))
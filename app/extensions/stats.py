@@ -0,0 +1,116 @@
+from typing import List, Optional
+
+from tortoise import Tortoise
+from discord.ext import commands
+from discord_slash import cog_ext
+from discord_slash.context import SlashContext
+from discord_slash.model import SlashCommandOptionType
+from discord_slash.utils.manage_commands import create_option
+
+import config
+from app.metrics import instrument
+from app.utils import pp_points
+from app.constants import STATS_PAGE_SIZE
+from app.queries import SELECT_EPOCHS_STATS_BEFORE, SELECT_USER_HISTORY_BEFORE
+
+EPOCH_ID_MAX = 2_147_483_647  # epoch id is INT, pages start below it when no cursor is given
+
+
+def before_epoch_option(description: str) -> dict:
+    return create_option(
+        name="before_epoch",
+        description=description,
+        option_type=SlashCommandOptionType.INTEGER,
+        required=False,
+    )
+
+
+def format_next_page(rows: List[dict], epoch_id_key: str, command: str) -> str:
+    """Keyset pagination cursor, next page starts right after the last shown epoch"""
+    if len(rows) < STATS_PAGE_SIZE:
+        return ""
+    return f"\nMore: `/{command} before_epoch:{rows[-1][epoch_id_key]}`"
+
+
+class StatsCog(commands.Cog):
+    """Cog which is responsible for staking stats available to admins"""
+
+    def __init__(self, bot: commands.Bot):
+        self.bot: commands.Bot = bot
+
+    async def is_allowed(self, ctx: SlashContext) -> bool:
+        # replicas which aren't the leader stay idle, so admins get only one reply
+        if not self.bot.leader_election.is_leader:
+            return False
+        if ctx.author_id not in config.ADMIN_USERS_IDS:
+            await ctx.send("Stats are available only to admins.", hidden=True)
+            return False
+        await self.bot.lifecycle.wait_until_warmed_up()
+        return True
+
+    @cog_ext.cog_slash(
+        name="hodl_epochs",
+        description="Staked points, stakers and projected payout per epoch",
+        options=[before_epoch_option("Show epochs before this one")],
+    )
+    @instrument("stats.epochs")
+    async def epochs_stats(self, ctx: SlashContext, before_epoch: Optional[int] = None) -> None:
+        if not await self.is_allowed(ctx):
+            return None
+        # totals come from epoch_stats which is maintained incrementally, so this doesn't depend on amount of users
+        rows = await Tortoise.get_connection("default").execute_query_dict(
+            SELECT_EPOCHS_STATS_BEFORE, [before_epoch or EPOCH_ID_MAX, STATS_PAGE_SIZE]
+        )
+        if not rows:
+            await ctx.send("No epochs found.", hidden=True)
+            return None
+        lines = [
+            f"Epoch №{row['id']} ({'settled' if row['settled_at'] else 'ends'} <t:{int(row['end_datetime'].timestamp())}>)"  # noqa: E501
+            f"\nStakers: `{row['stakers_count']}`"
+            f" Staked Points: `{pp_points(row['epoch_lowest_balance_sum'] * row['portfolio_percentage'])}`{config.POINTS_EMOJI}"  # noqa: E501
+            f" Projected Payout: `{pp_points(row['epoch_lowest_balance_sum'] * row['apy'] * row['portfolio_percentage'])}`{config.POINTS_EMOJI}"  # noqa: E501
+            for row in rows
+        ]
+        await ctx.send("\n".join(lines) + format_next_page(rows, "id", "hodl_epochs"), hidden=True)
+
+    @cog_ext.cog_slash(
+        name="hodl_user_history",
+        description="Staked points and rewards of the user per epoch",
+        options=[
+            create_option(
+                name="user",
+                description="User to show history of",
+                option_type=SlashCommandOptionType.USER,
+                required=True,
+            ),
+            before_epoch_option("Show epochs before this one"),
+        ],
+    )
+    @instrument("stats.user_history")
+    async def user_history(self, ctx: SlashContext, user, before_epoch: Optional[int] = None) -> None:
+        if not await self.is_allowed(ctx):
+            return None
+        # user is passed as id if discord_slash couldn't resolve it
+        user_id = int(getattr(user, "id", user))
+        rows = await Tortoise.get_connection("default").execute_query_dict(
+            SELECT_USER_HISTORY_BEFORE, [user_id, before_epoch or EPOCH_ID_MAX, STATS_PAGE_SIZE]
+        )
+        if not rows:
+            await ctx.send(f"No staking history of <@{user_id}>.", hidden=True)
+            return None
+        lines = [
+            f"Epoch №{row['epoch_id']} (ends <t:{int(row['end_datetime'].timestamp())}>)"
+            f"\nStaked Points: `{pp_points(row['epoch_lowest_balance'] * row['portfolio_percentage'])}`{config.POINTS_EMOJI}"  # noqa: E501
+            + (
+                f" Reward: `{pp_points(row['reward'])}`{config.POINTS_EMOJI}"
+                if row["reward"] is not None
+                else f" Estimated Reward: `{pp_points(row['epoch_lowest_balance'] * row['apy'] * row['portfolio_percentage'])}`{config.POINTS_EMOJI}"  # noqa: E501
+            )
+            for row in rows
+        ]
+        content = f"Staking history of <@{user_id}>\n" + "\n".join(lines)
+        await ctx.send(content + format_next_page(rows, "epoch_id", f"hodl_user_history user:{user_id}"), hidden=True)
+
+
+def setup(bot):
+    bot.add_cog(StatsCog(bot))
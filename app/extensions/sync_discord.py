@@ -1,14 +1,22 @@
-import re
-from decimal import Decimal
+import asyncio
+import logging
+import datetime
 
 import discord
-from discord.ext import commands
-from tortoise.query_utils import Q
-from tortoise.transactions import in_transaction
-
-import config
-from app.models import User, Epoch
-from app.utils import update_balance_and_epoch_lowest_balance
+from discord.ext import commands, tasks
+from sentry_sdk import capture_exception
+
+from app.batching import PointsEventBatcher
+from app.metrics import timed, POINTS_LOG_EVENTS
+from app.parsers import get_points_log_parser
+from app.replay import replay_channels_history, get_high_water_mark
+from app.utils import get_points_log_channel_id, get_points_log_channels_ids
+from app.constants import (
+    STAKING_REGISTRY_RECONCILE_IN_MINUTES,
+    POINTS_LOG_REPLAY_RETRY_IN_SECONDS,
+    POINTS_LOG_IDLE_CHECKPOINT_IN_SECONDS,
+    POINTS_LOG_IDLE_CHECKPOINT_LAG_IN_SECONDS,
+)
 
 
 class SyncDiscordCog(commands.Cog):
@@ -16,7 +24,50 @@ class SyncDiscordCog(commands.Cog):
 
     def __init__(self, bot: commands.Bot):
         self.bot: commands.Bot = bot
-        self.points_regex = re.compile("<:points:915573121631793162>(\\d*\\.?\\d+)")
+        # events are written to database in batches, see PointsEventBatcher
+        self.batcher = PointsEventBatcher(staking_registry=self.bot.staking_registry)
+        self.parser = get_points_log_parser()
+        self.replay_lock = asyncio.Lock()
+        self.is_caught_up = asyncio.Event()  # messages posted while bot was offline are submitted
+        self.batcher_task = self.bot.loop.create_task(self.batcher.run())
+        self.reconcile_staking_registry_task.start()
+        self.checkpoint_idle_task.start()
+
+    def cog_unload(self):
+        self.batcher_task.cancel()
+        self.reconcile_staking_registry_task.cancel()
+        self.checkpoint_idle_task.cancel()
+
+    @tasks.loop(minutes=STAKING_REGISTRY_RECONCILE_IN_MINUTES)
+    async def reconcile_staking_registry_task(self):
+        try:
+            await self.bot.staking_registry.reconcile()
+            logging.debug(f":::hodl_bot: staking registry stats: {self.bot.staking_registry.stats()}")
+        except Exception as e:
+            logging.error(f":::hodl_bot: {e}")
+            capture_exception(e)
+
+    @reconcile_staking_registry_task.before_loop
+    async def before_reconcile_staking_registry_task(self):
+        await self.bot.wait_until_ready()
+        await self.bot.lifecycle.wait_until_warmed_up()
+
+    @tasks.loop(seconds=POINTS_LOG_IDLE_CHECKPOINT_IN_SECONDS)
+    async def checkpoint_idle_task(self):
+        # high water mark moves only with messages, epochs are settled once it has passed their end
+        try:
+            received_until = datetime.datetime.utcnow() - datetime.timedelta(
+                seconds=POINTS_LOG_IDLE_CHECKPOINT_LAG_IN_SECONDS
+            )
+            await self.batcher.checkpoint_idle(discord.utils.time_snowflake(received_until))
+        except Exception as e:
+            logging.error(f":::hodl_bot: {e}")
+            capture_exception(e)
+
+    @checkpoint_idle_task.before_loop
+    async def before_checkpoint_idle_task(self):
+        await self.bot.wait_until_ready()
+        await self.wait_until_caught_up()
 
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message) -> None:
@@ -28,48 +79,76 @@ class SyncDiscordCog(commands.Cog):
         if not message.guild:
             return None
 
-        # only react to messages from points log channel
-        if not message.channel.id == config.POINTS_LOG_CHANNEL_ID:
+        # only react to messages from points log channel of the guild
+        if not message.channel.id == get_points_log_channel_id(message.guild.id):
             return None
 
-        # parse message event
-        sender_id = message.raw_mentions[0]
-        receivers_ids = message.raw_mentions[1:]
-        # remove comma from string (because of The Accountant Bot)
-        points = Decimal(self.points_regex.findall(message.system_content.replace(",", ""))[0])
-
-        # check which users are in database and are staking
-        staking_users_ids = await User.filter(Q(id__in=[*receivers_ids, sender_id]) & Q(is_staking=True)).values_list(
-            "id", flat=True
-        )
-        is_sender_staking = sender_id in staking_users_ids
-        receivers_who_stake_ids = list(set(receivers_ids).intersection(set(staking_users_ids)))
-
-        # get current epoch
-        current_epoch = await Epoch.all().order_by("-id").first()
-
-        async with in_transaction():
-            # update sender points if they are staking
-            if is_sender_staking:
-                await update_balance_and_epoch_lowest_balance(
-                    user_id=sender_id,
-                    points=points,
-                    epoch_id=current_epoch.id,
-                    is_sender=True,
-                )
-
-            # update receivers if they are staking
-            if receivers_who_stake_ids:
-                for receiver_id in receivers_who_stake_ids:
-                    await update_balance_and_epoch_lowest_balance(
-                        user_id=receiver_id,
-                        points=points,
-                        epoch_id=current_epoch.id,
-                        is_sender=False,
-                    )
-
+        # staking registry has to be loaded before events are filtered by it
+        await self.bot.lifecycle.wait_until_warmed_up()
+        with timed("sync_discord.on_message"):
+            event = self.parser.parse(message.id, message.system_content)
+            if event is None:
+                POINTS_LOG_EVENTS.inc("unparseable")
+                logging.debug(f":::hodl_bot: skipped unparseable points log message {message.id}")
+                return None
+            await self.batcher.submit(event)
         return None
 
+    async def load_high_water_mark(self) -> None:
+        """
+        Must be called before any event of this run is written: live events arrive before on_ready
+        and would move high water mark past messages which were posted while bot was offline.
+        """
+        high_water_mark = await get_high_water_mark()
+        if high_water_mark is None:
+            # first start, there is nothing to catch up with
+            return None
+        self.batcher.last_submitted_message_id = max(self.batcher.last_submitted_message_id, high_water_mark)
+        self.batcher.request_replay(high_water_mark)
+
+    @commands.Cog.listener()
+    async def on_disconnect(self) -> None:
+        # messages posted until the bot reconnects can be missed, they are replayed once it's ready or resumed
+        if self.batcher.last_submitted_message_id:
+            self.batcher.request_replay(self.batcher.last_submitted_message_id)
+
+    @commands.Cog.listener()
+    async def on_ready(self) -> None:
+        await self.catch_up()
+
+    @commands.Cog.listener()
+    async def on_resumed(self) -> None:
+        await self.catch_up()
+
+    async def catch_up(self) -> None:
+        """Replay channel history requested by startup and disconnects"""
+        # replays requested while one is running are picked up by it
+        if self.replay_lock.locked():
+            return None
+        async with self.replay_lock:
+            await self.bot.lifecycle.wait_until_warmed_up()
+            while self.batcher.replay_after is not None:
+                after_message_id = self.batcher.start_replay()
+                try:
+                    channels = [self.bot.get_channel(channel_id) for channel_id in get_points_log_channels_ids()]
+                    replayed_count = await replay_channels_history(
+                        channels, self.batcher, self.parser, after_message_id
+                    )
+                    logging.info(f":::hodl_bot: replayed {replayed_count} points log messages")
+                except Exception as e:
+                    logging.error(f":::hodl_bot: {e}")
+                    capture_exception(e)
+                    # high water mark stays where replay has got to until the rest is replayed
+                    self.batcher.request_replay(self.batcher.replay_cursor)
+                    await asyncio.sleep(POINTS_LOG_REPLAY_RETRY_IN_SECONDS)
+                finally:
+                    self.batcher.replay_cursor = None
+            self.is_caught_up.set()
+
+    async def wait_until_caught_up(self) -> None:
+        """Wait until events saved by the previous shutdown and posted while bot was offline are submitted"""
+        await self.is_caught_up.wait()
+
 
 def setup(bot):
     bot.add_cog(SyncDiscordCog(bot))
@@ -0,0 +1,60 @@
+import asyncio
+import logging
+from typing import Optional
+
+import asyncpg
+from sentry_sdk import capture_exception
+
+from app.queries import TRY_LEADER_LOCK
+from app.constants import LEADER_ELECTION_INTERVAL_IN_SECONDS
+
+
+class LeaderElection:
+    """
+    Only the leader among bot replicas runs scheduled jobs, the rest stay idle.
+    Leadership is a session level advisory lock, so it's released as soon as the leader's connection is gone.
+    """
+
+    def __init__(self, credentials: dict, name: str):
+        self.credentials = credentials
+        self.name = name  # replicas with the same name compete for leadership
+        self._connection: Optional[asyncpg.Connection] = None
+        self._is_leader = asyncio.Event()
+
+    @property
+    def is_leader(self) -> bool:
+        return self._is_leader.is_set()
+
+    async def wait_until_leader(self) -> None:
+        await self._is_leader.wait()
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.elect()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.resign()
+                logging.error(f":::hodl_bot: {e}")
+                capture_exception(e)
+            await asyncio.sleep(LEADER_ELECTION_INTERVAL_IN_SECONDS)
+
+    async def elect(self) -> None:
+        if self._connection is None or self._connection.is_closed():
+            self.resign()
+            self._connection = await asyncpg.connect(**self.credentials)
+        if self.is_leader:
+            # make sure the connection holding the lock is still alive
+            await self._connection.fetchval("SELECT 1")
+        elif await self._connection.fetchval(TRY_LEADER_LOCK, self.name):
+            logging.info(f":::hodl_bot: became the {self.name} leader, scheduled jobs will run in this process")
+            self._is_leader.set()
+
+    def resign(self) -> None:
+        if self.is_leader:
+            logging.warning(":::hodl_bot: lost leadership, scheduled jobs are paused")
+        self._is_leader.clear()
+        if self._connection is not None and not self._connection.is_closed():
+            self._connection.terminate()
+        self._connection = None
@@ -0,0 +1,157 @@
+import gc
+import time
+import signal
+import asyncio
+import logging
+import pathlib
+import contextlib
+from typing import Dict, Optional
+
+from tortoise import Tortoise
+from discord.ext import commands
+
+from app.metrics import STARTUP_PHASE_DURATION
+from app.constants import SHUTDOWN_DRAIN_TIMEOUT_IN_SECONDS
+
+
+class Lifecycle:
+    """
+    Run the bot until SIGTERM/SIGINT and shut it down in order, so no balance work is lost:
+    points log stops accepting events, queued events are flushed or saved to the write-ahead file,
+    replies are sent, jobs are cancelled (their transactions are rolled back) and connections are closed.
+    Without a graceful shutdown (e.g. SIGKILL) events are caught up from points log channel history instead.
+
+    Database, caches and events saved by the previous shutdown are warmed up while the bot connects to Discord,
+    handlers which need them wait in wait_until_warmed_up. Every startup phase is logged and exported as a metric.
+    """
+
+    def __init__(
+        self,
+        bot: commands.Bot,
+        orm_config: dict,
+        wal_path: str,
+        drain_timeout: float = SHUTDOWN_DRAIN_TIMEOUT_IN_SECONDS,
+    ):
+        self.bot = bot
+        self.orm_config = orm_config
+        self.wal_path = pathlib.Path(wal_path)
+        self.drain_timeout = drain_timeout
+        self.started_at = time.perf_counter()  # created right after imports, so startup is timed from here
+        self.phases: Dict[str, float] = {}  # phase -> seconds
+        self.is_warmed_up = asyncio.Event()
+        self.warm_up_task: Optional[asyncio.Task] = None
+        self.shutdown_requested = asyncio.Event()
+        self.is_shut_down = False
+
+    def run(self, token: str) -> None:
+        """Same as bot.run, but shutdown drains pending work instead of cancelling it"""
+        loop = self.bot.loop
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signal_number, self.shutdown_requested.set)
+            except NotImplementedError:
+                # not supported on Windows
+                pass
+        try:
+            loop.run_until_complete(self.serve(token))
+        finally:
+            loop.run_until_complete(self.shutdown())
+            loop.close()
+
+    async def serve(self, token: str) -> None:
+        self.warm_up_task = asyncio.ensure_future(self.warm_up())
+        asyncio.ensure_future(self.report_ready(connecting_since=time.perf_counter()))
+        bot_task = asyncio.ensure_future(self.bot.start(token))
+        shutdown_requested_task = asyncio.ensure_future(self.shutdown_requested.wait())
+        pending = {self.warm_up_task, bot_task, shutdown_requested_task}
+        while bot_task in pending and shutdown_requested_task in pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done - {shutdown_requested_task}:
+                # e.g. login failed or database is unreachable
+                task.result()
+        shutdown_requested_task.cancel()
+
+    async def warm_up(self) -> None:
+        with self.phase("database"):
+            await Tortoise.init(config=self.orm_config)
+        with self.phase("caches"):
+            # loading staking users allocates a row per user, garbage collector would walk all objects many times
+            gc.disable()
+            try:
+                await asyncio.gather(self.bot.staking_registry.load(), self.bot.epoch_provider.refresh())
+            finally:
+                gc.enable()
+        # saved events are applied before live ones, so they are applied in the order they were posted
+        with self.phase("wal"):
+            await self.restore()
+        # modules and caches live as long as the process, full collections don't have to walk them anymore
+        gc.freeze()
+        self.is_warmed_up.set()
+
+    async def wait_until_warmed_up(self) -> None:
+        """Wait until database and caches are ready, events received before that are handled right after"""
+        await self.is_warmed_up.wait()
+
+    async def report_ready(self, connecting_since: float) -> None:
+        await self.bot.wait_until_ready()
+        self.record_phase("gateway", time.perf_counter() - connecting_since)
+        await self.is_warmed_up.wait()
+        # since startup began, events are handled from here on
+        self.record_phase("ready", time.perf_counter() - self.started_at)
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        started_at = time.perf_counter()
+        yield
+        self.record_phase(name, time.perf_counter() - started_at)
+
+    def record_phase(self, name: str, seconds: float) -> None:
+        self.phases[name] = seconds
+        STARTUP_PHASE_DURATION.set(seconds, name)
+        logging.info(f":::hodl_bot: startup phase {name} took {seconds:.3f}s")
+
+    async def restore(self) -> None:
+        sync_discord = self.bot.get_cog("SyncDiscordCog")
+        if sync_discord is None:
+            return None
+        await sync_discord.load_high_water_mark()
+        restored_count = await sync_discord.batcher.restore(self.wal_path)
+        if restored_count:
+            logging.info(f":::hodl_bot: restored {restored_count} points log events from {self.wal_path}")
+
+    async def shutdown(self) -> None:
+        if self.is_shut_down:
+            return None
+        self.is_shut_down = True
+        logging.info(":::hodl_bot: shutting down")
+        # restore can't remove the write-ahead file after shutdown has written to it
+        if self.warm_up_task is not None:
+            self.warm_up_task.cancel()
+            await asyncio.gather(self.warm_up_task, return_exceptions=True)
+        sync_discord = self.bot.get_cog("SyncDiscordCog")
+        if sync_discord is not None:
+            saved_count = await sync_discord.batcher.shutdown(self.wal_path, self.drain_timeout)
+            if saved_count:
+                logging.warning(f":::hodl_bot: saved {saved_count} points log events to {self.wal_path}")
+        onboarding = self.bot.get_cog("OnboardingCog")
+        if onboarding is not None:
+            try:
+                await asyncio.wait_for(self.drain_replies(onboarding), self.drain_timeout)
+            except asyncio.TimeoutError:
+                logging.warning(f":::hodl_bot: replies which weren't sent in {self.drain_timeout}s are dropped")
+        await self.bot.close()
+        # jobs and background tasks, transactions they are in the middle of are rolled back
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # let another replica take over right away instead of waiting for the connection to time out
+        self.bot.leader_election.resign()
+        await self.bot.accountant.close()
+        await Tortoise.close_connections()
+        logging.info(":::hodl_bot: shut down")
+
+    @staticmethod
+    async def drain_replies(onboarding) -> None:
+        await onboarding.drain()
+        await onboarding.send_queue.drain()
@@ -0,0 +1,209 @@
+"""Lightweight in-process metrics exposed in Prometheus text format"""
+import time
+import asyncio
+import bisect
+import logging
+import contextlib
+import functools
+import contextvars
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import sentry_sdk
+from aiohttp import web
+
+# handler which is currently running, used to attribute database queries
+current_handler: contextvars.ContextVar[str] = contextvars.ContextVar("current_handler", default="other")
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        REGISTRY.append(self)
+
+    @abstractmethod
+    def samples(self) -> List[Tuple[str, Tuple[Tuple[str, str], ...], float]]:
+        """(name, labels, value) of every series of the metric"""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for name, labels, value in self.samples():
+            rendered_labels = ",".join(f'{label}="{label_value}"' for label, label_value in labels)
+            lines.append(f"{name}{{{rendered_labels}}} {value}" if labels else f"{name} {value}")
+        return "\n".join(lines)
+
+    def _label_pairs(self, label_values: Tuple[str, ...]) -> Tuple[Tuple[str, str], ...]:
+        return tuple(zip(self.labels, label_values))
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        return [(self.name, self._label_pairs(key), value) for key, value in self.values.items()]
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, *label_values: str) -> None:
+        self.values[label_values] = value
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def dec(self, *label_values: str, amount: float = 1) -> None:
+        self.inc(*label_values, amount=-amount)
+
+    def samples(self):
+        return [(self.name, self._label_pairs(key), value) for key, value in self.values.items()]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # label values -> (counts per bucket, sum, count)
+        self.values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        observations = self.values.get(label_values)
+        if observations is None:
+            observations = self.values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+        bucket_index = bisect.bisect_left(self.buckets, value)
+        if bucket_index < len(self.buckets):
+            observations[0][bucket_index] += 1
+        observations[1] += value
+        observations[2] += 1
+
+    def samples(self):
+        samples = []
+        for key, (bucket_counts, total, count) in self.values.items():
+            labels = self._label_pairs(key)
+            cumulative_count = 0
+            for bucket, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative_count += bucket_count
+                samples.append((f"{self.name}_bucket", (*labels, ("le", str(bucket))), cumulative_count))
+            samples.append((f"{self.name}_bucket", (*labels, ("le", "+Inf")), count))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+REGISTRY: List[Metric] = []
+
+HANDLER_DURATION = Histogram("hodl_handler_duration_seconds", "Time spent in bot handlers", ["handler"])
+HANDLER_ERRORS = Counter("hodl_handler_errors_total", "Exceptions raised by bot handlers", ["handler"])
+POINTS_LOG_EVENTS = Counter("hodl_points_log_events_total", "Points log events by outcome", ["status"])
+DB_QUERIES = Counter("hodl_db_queries_total", "Database queries by handler", ["handler"])
+DB_QUERY_DURATION = Histogram("hodl_db_query_duration_seconds", "Database query latency by handler", ["handler"])
+DB_POOL_MAX_SIZE = Gauge("hodl_db_pool_max_size", "Max amount of connections in database pool")
+DB_POOL_IN_USE = Gauge("hodl_db_pool_in_use", "Database connections which are checked out of the pool")
+DB_POOL_WAITING = Gauge("hodl_db_pool_waiting", "Handlers waiting for a free database connection")
+DB_POOL_WAIT_DURATION = Histogram(
+    "hodl_db_pool_wait_duration_seconds", "Time spent waiting for a free database connection", ["handler"]
+)
+DB_POOL_ACQUIRE_TIMEOUTS = Counter(
+    "hodl_db_pool_acquire_timeouts_total", "Handlers which gave up waiting for a database connection", ["handler"]
+)
+EVENT_LOOP_LAG = Gauge("hodl_event_loop_lag_seconds", "How late the event loop wakes up a sleeping task")
+POINTS_LOG_QUEUE_DEPTH = Gauge("hodl_points_log_queue_depth", "Points log events waiting for flush")
+POINTS_LOG_FLUSH_SIZE = Histogram(
+    "hodl_points_log_flush_size", "Points log events per flush", buckets=(1, 5, 10, 50, 100, 500, 1000)
+)
+STAKING_REGISTRY_LOOKUPS = Counter("hodl_staking_registry_lookups_total", "Staking registry lookups", ["result"])
+DM_COALESCED_MESSAGES = Counter(
+    "hodl_dm_coalesced_messages_total", "DMs which were answered by an already pending reply"
+)
+DM_SEND_QUEUE_DEPTH = Gauge("hodl_dm_send_queue_depth", "Direct messages waiting to be sent")
+DM_SENDS = Counter("hodl_dm_sends_total", "Direct messages by outcome", ["status"])
+STARTUP_PHASE_DURATION = Gauge("hodl_startup_phase_seconds", "Time spent in startup phases", ["phase"])
+
+# sentry performance transactions are only created when tracing is enabled
+sentry_tracing_enabled = False
+
+
+@contextlib.contextmanager
+def timed(handler: str):
+    """Measure handler duration, its database queries are attributed to it"""
+    token = current_handler.set(handler)
+    transaction = sentry_sdk.start_transaction(op="handler", name=handler) if sentry_tracing_enabled else None
+    started_at = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        HANDLER_ERRORS.inc(handler)
+        raise
+    finally:
+        HANDLER_DURATION.observe(time.perf_counter() - started_at, handler)
+        if transaction is not None:
+            transaction.finish()
+        current_handler.reset(token)
+
+
+def instrument(handler: str):
+    """Same as timed but for a coroutine function, e.g. cog listener or component callback"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with timed(handler):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def render_metrics() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(host: str, port: int) -> Optional[web.AppRunner]:
+    """Serve /metrics from the bot's event loop, bot runs without them if the port can't be bound"""
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        await runner.cleanup()
+        logging.error(f":::hodl_bot: can't serve metrics on {host}:{port}, running without them: {e}")
+        sentry_sdk.capture_exception(e)
+        return None
+    logging.info(f":::hodl_bot: serving metrics on http://{host}:{port}/metrics")
+    return runner
+
+
+async def measure_event_loop_lag(interval_in_seconds: float = 1) -> None:
+    loop = asyncio.get_event_loop()
+    while True:
+        started_at = loop.time()
+        await asyncio.sleep(interval_in_seconds)
+        EVENT_LOOP_LAG.set(max(loop.time() - started_at - interval_in_seconds, 0))
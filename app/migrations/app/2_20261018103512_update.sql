@@ -0,0 +1,9 @@
+-- upgrade --
+CREATE TABLE IF NOT EXISTS "job_checkpoint" (
+    "name" VARCHAR(64) NOT NULL  PRIMARY KEY,
+    "value" VARCHAR(255) NOT NULL,
+    "modified_at" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP
+);
+COMMENT ON TABLE "job_checkpoint" IS 'Progress of long running jobs, so they can be resumed after restart';
+-- downgrade --
+DROP TABLE IF EXISTS "job_checkpoint";
@@ -0,0 +1,19 @@
+-- upgrade --
+ALTER TABLE "epoch" ADD "settled_at" TIMESTAMPTZ;
+ALTER TABLE "epoch" ADD "reported_at" TIMESTAMPTZ;
+-- epochs which ended before rewards were reported aren't reported all at once on the first deploy
+UPDATE "epoch" SET "reported_at" = CURRENT_TIMESTAMP WHERE "end_datetime" < CURRENT_TIMESTAMP;
+CREATE TABLE IF NOT EXISTS "epoch_reward" (
+    "id" BIGSERIAL NOT NULL PRIMARY KEY,
+    "staked_points" DECIMAL(15,4) NOT NULL,
+    "reward" DECIMAL(15,4) NOT NULL,
+    "created_at" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP,
+    "epoch_id" INT NOT NULL REFERENCES "epoch" ("id") ON DELETE CASCADE,
+    "user_id" BIGINT NOT NULL REFERENCES "user" ("id") ON DELETE CASCADE,
+    CONSTRAINT "uid_epoch_rewar_user_id_750760" UNIQUE ("user_id", "epoch_id")
+);
+COMMENT ON TABLE "epoch_reward" IS 'Reward earned by user for the epoch, calculated once the epoch ends';
+-- downgrade --
+ALTER TABLE "epoch" DROP COLUMN "settled_at";
+ALTER TABLE "epoch" DROP COLUMN "reported_at";
+DROP TABLE IF EXISTS "epoch_reward";
@@ -0,0 +1,12 @@
+-- upgrade --
+CREATE TABLE IF NOT EXISTS "balance_event" (
+    "id" BIGINT NOT NULL PRIMARY KEY,
+    "sender_id" BIGINT NOT NULL,
+    "receivers_ids" JSONB NOT NULL,
+    "points" DECIMAL(15,4) NOT NULL,
+    "epochs_ids" JSONB NOT NULL,
+    "created_at" TIMESTAMPTZ NOT NULL
+);
+COMMENT ON TABLE "balance_event" IS 'Append-only ledger of applied points log events, guarantees that every event is applied only once';
+-- downgrade --
+DROP TABLE IF EXISTS "balance_event";
@@ -0,0 +1,4 @@
+-- upgrade --
+CREATE UNIQUE INDEX "uid_epoch_start_d_157a28" ON "epoch" ("start_datetime");
+-- downgrade --
+DROP INDEX "uid_epoch_start_d_157a28";
@@ -0,0 +1,5 @@
+-- upgrade --
+DELETE FROM "user_epoch" AS ue USING "user_epoch" AS duplicate WHERE ue."user_id" = duplicate."user_id" AND ue."epoch_id" = duplicate."epoch_id" AND (ue."epoch_lowest_balance", ue."id") > (duplicate."epoch_lowest_balance", duplicate."id");
+CREATE UNIQUE INDEX "uid_user_epoch_user_id_f92df5" ON "user_epoch" ("user_id", "epoch_id");
+-- downgrade --
+DROP INDEX "uid_user_epoch_user_id_f92df5";
@@ -0,0 +1,10 @@
+-- upgrade --
+CREATE INDEX "idx_user_is_staking" ON "user" ("id") WHERE "is_staking";
+CREATE INDEX "idx_epoch_end_dat_9af0df" ON "epoch" ("end_datetime");
+CREATE INDEX "idx_user_epoch_epoch_i_2eb13c" ON "user_epoch" ("epoch_id");
+CREATE INDEX "idx_epoch_rewar_epoch_i_0fb958" ON "epoch_reward" ("epoch_id", "id");
+-- downgrade --
+DROP INDEX "idx_user_is_staking";
+DROP INDEX "idx_epoch_end_dat_9af0df";
+DROP INDEX "idx_user_epoch_epoch_i_2eb13c";
+DROP INDEX "idx_epoch_rewar_epoch_i_0fb958";
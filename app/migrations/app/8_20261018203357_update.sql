@@ -0,0 +1,61 @@
+-- upgrade --
+CREATE TABLE IF NOT EXISTS "epoch_stats" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "stakers_count" INT NOT NULL  DEFAULT 0,
+    "epoch_lowest_balance_sum" DECIMAL(30,4) NOT NULL  DEFAULT 0,
+    "modified_at" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP,
+    "epoch_id" INT NOT NULL UNIQUE REFERENCES "epoch" ("id") ON DELETE CASCADE
+);
+COMMENT ON TABLE "epoch_stats" IS 'Totals of the epoch''s UserEpoch rows, kept up to date by statement level triggers on user_epoch table.';
+INSERT INTO "epoch_stats" ("epoch_id", "stakers_count", "epoch_lowest_balance_sum") SELECT "epoch_id", count(*) FILTER (WHERE "epoch_lowest_balance" > 0), sum("epoch_lowest_balance") FROM "user_epoch" GROUP BY "epoch_id";
+-- every statement which changes "user_epoch" moves totals of the touched epochs by the difference between new and old rows.
+-- Statements inside function bodies don't end lines, aerich splits migrations on ";\n"
+CREATE FUNCTION "epoch_stats_after_user_epoch_insert"() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO "epoch_stats" ("epoch_id", "stakers_count", "epoch_lowest_balance_sum")
+    SELECT "epoch_id", count(*) FILTER (WHERE "epoch_lowest_balance" > 0), sum("epoch_lowest_balance")
+    FROM "new_rows" GROUP BY "epoch_id"
+    ON CONFLICT ("epoch_id") DO UPDATE
+    SET "stakers_count" = "epoch_stats"."stakers_count" + EXCLUDED."stakers_count",
+    "epoch_lowest_balance_sum" = "epoch_stats"."epoch_lowest_balance_sum" + EXCLUDED."epoch_lowest_balance_sum",
+    "modified_at" = CURRENT_TIMESTAMP; RETURN NULL; END
+$$;
+CREATE FUNCTION "epoch_stats_after_user_epoch_update"() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO "epoch_stats" ("epoch_id", "stakers_count", "epoch_lowest_balance_sum")
+    SELECT d."epoch_id", sum(d."stakers_count"), sum(d."epoch_lowest_balance")
+    FROM (
+        SELECT "epoch_id", ("epoch_lowest_balance" > 0)::int AS "stakers_count", "epoch_lowest_balance" FROM "new_rows"
+        UNION ALL
+        SELECT "epoch_id", -("epoch_lowest_balance" > 0)::int, -"epoch_lowest_balance" FROM "old_rows"
+    ) AS d
+    GROUP BY d."epoch_id"
+    ON CONFLICT ("epoch_id") DO UPDATE
+    SET "stakers_count" = "epoch_stats"."stakers_count" + EXCLUDED."stakers_count",
+    "epoch_lowest_balance_sum" = "epoch_stats"."epoch_lowest_balance_sum" + EXCLUDED."epoch_lowest_balance_sum",
+    "modified_at" = CURRENT_TIMESTAMP; RETURN NULL; END
+$$;
+CREATE FUNCTION "epoch_stats_after_user_epoch_delete"() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE "epoch_stats" AS s
+    SET "stakers_count" = s."stakers_count" - d."stakers_count",
+    "epoch_lowest_balance_sum" = s."epoch_lowest_balance_sum" - d."epoch_lowest_balance",
+    "modified_at" = CURRENT_TIMESTAMP
+    FROM (
+        SELECT "epoch_id", count(*) FILTER (WHERE "epoch_lowest_balance" > 0) AS "stakers_count",
+        sum("epoch_lowest_balance") AS "epoch_lowest_balance"
+        FROM "old_rows" GROUP BY "epoch_id"
+    ) AS d
+    WHERE s."epoch_id" = d."epoch_id"; RETURN NULL; END
+$$;
+CREATE TRIGGER "epoch_stats_after_user_epoch_insert" AFTER INSERT ON "user_epoch" REFERENCING NEW TABLE AS "new_rows" FOR EACH STATEMENT EXECUTE FUNCTION "epoch_stats_after_user_epoch_insert"();
+CREATE TRIGGER "epoch_stats_after_user_epoch_update" AFTER UPDATE ON "user_epoch" REFERENCING OLD TABLE AS "old_rows" NEW TABLE AS "new_rows" FOR EACH STATEMENT EXECUTE FUNCTION "epoch_stats_after_user_epoch_update"();
+CREATE TRIGGER "epoch_stats_after_user_epoch_delete" AFTER DELETE ON "user_epoch" REFERENCING OLD TABLE AS "old_rows" FOR EACH STATEMENT EXECUTE FUNCTION "epoch_stats_after_user_epoch_delete"();
+-- downgrade --
+DROP TRIGGER "epoch_stats_after_user_epoch_insert" ON "user_epoch";
+DROP TRIGGER "epoch_stats_after_user_epoch_update" ON "user_epoch";
+DROP TRIGGER "epoch_stats_after_user_epoch_delete" ON "user_epoch";
+DROP FUNCTION "epoch_stats_after_user_epoch_insert";
+DROP FUNCTION "epoch_stats_after_user_epoch_update";
+DROP FUNCTION "epoch_stats_after_user_epoch_delete";
+DROP TABLE IF EXISTS "epoch_stats";
@@ -0,0 +1,10 @@
+-- upgrade --
+DELETE FROM "user_epoch" AS ue USING "user" AS u WHERE u."id" = ue."user_id" AND NOT u."is_staking" AND ue."epoch_lowest_balance" = 0;
+ALTER TABLE "user_epoch" DROP COLUMN "id";
+ALTER TABLE "user_epoch" ADD COLUMN "id" BIGSERIAL NOT NULL PRIMARY KEY;
+COMMENT ON TABLE "user_epoch" IS 'Many to many relationship between user and epoch.';
+-- downgrade --
+ALTER TABLE "user_epoch" DROP COLUMN "id";
+ALTER TABLE "user_epoch" ADD COLUMN "id" UUID NOT NULL DEFAULT gen_random_uuid() PRIMARY KEY;
+ALTER TABLE "user_epoch" ALTER COLUMN "id" DROP DEFAULT;
+COMMENT ON TABLE "user_epoch" IS 'Many to many relationship between user and epoch';
@@ -15,7 +15,9 @@ class User(Model):
         default=0,
         validators=[PositiveValueValidator()],
     )  # if user is staking this balance will always be synced with real balance
-    is_staking = fields.BooleanField(default=False)  # is user participating in staking or not
+    # is user participating in staking or not, stakers are looked up via partial index "idx_user_is_staking"
+    # which is created by raw migration (tortoise can't declare partial indexes)
+    is_staking = fields.BooleanField(default=False)
     staking_started_date = fields.data.DatetimeField(null=True)
     created_at = fields.DatetimeField(auto_now_add=True)
     modified_at = fields.DatetimeField(auto_now=True)
@@ -28,8 +30,8 @@ class Epoch(Model):
     """Staking Epoch table"""
 
     id = fields.IntField(pk=True)
-    start_datetime = fields.data.DatetimeField()
-    end_datetime = fields.data.DatetimeField()
+    start_datetime = fields.data.DatetimeField(unique=True)  # two replicas can't create the same epoch
+    end_datetime = fields.data.DatetimeField(index=True)
     # APY per epoch in % (aka 0.025 means 2.5%)
     apy = fields.data.DecimalField(
         max_digits=15,
@@ -45,19 +47,25 @@ class Epoch(Model):
         validators=[PositiveValueValidator()],
     )
     users = fields.ManyToManyField("app.User", related_name="epochs", through="user_epoch")
+    settled_at = fields.DatetimeField(null=True)  # when rewards were calculated
+    reported_at = fields.DatetimeField(null=True)  # when rewards report was sent to admins
     created_at = fields.DatetimeField(auto_now_add=True)
     modified_at = fields.DatetimeField(auto_now=True)
 
     user_epochs: fields.ReverseRelation["UserEpoch"]
+    epoch_rewards: fields.ReverseRelation["EpochReward"]
 
     def __str__(self):
         return f"Epoch №{self.id}"
 
 
 class UserEpoch(Model):
-    """Many to many relationship between user and epoch"""
+    """
+    Many to many relationship between user and epoch.
+    Only users who stake in the epoch have a row, missing row means that user doesn't stake.
+    """
 
-    id = fields.UUIDField(pk=True)
+    id = fields.BigIntField(pk=True)
     user = fields.ForeignKeyField("app.User", related_name="user_epochs")
     epoch = fields.ForeignKeyField("app.Epoch", related_name="user_epochs")
     # this balance will be used to determine APY per epoch (epoch_lowest_balance * apy * portfolio_percentage)
@@ -77,3 +85,79 @@ class UserEpoch(Model):
 
     class Meta:
         table = "user_epoch"
+        unique_together = (("user", "epoch"),)
+        # rewards are calculated for all users of the epoch at once
+        indexes = (("epoch_id",),)
+
+
+class EpochReward(Model):
+    """Reward earned by user for the epoch, calculated once the epoch ends"""
+
+    id = fields.BigIntField(pk=True)
+    user = fields.ForeignKeyField("app.User", related_name="epoch_rewards")
+    epoch = fields.ForeignKeyField("app.Epoch", related_name="epoch_rewards")
+    # epoch_lowest_balance * portfolio_percentage
+    staked_points = fields.data.DecimalField(max_digits=15, decimal_places=4)
+    # epoch_lowest_balance * apy * portfolio_percentage
+    reward = fields.data.DecimalField(max_digits=15, decimal_places=4)
+    created_at = fields.DatetimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"EpochReward №{self.id}"
+
+    class Meta:
+        table = "epoch_reward"
+        unique_together = (("user", "epoch"),)
+        # rewards report pages through the epoch by id
+        indexes = (("epoch_id", "id"),)
+
+
+class EpochStats(Model):
+    """
+    Totals of the epoch's UserEpoch rows, kept up to date by statement level triggers on user_epoch table.
+    Triggers are created by raw migration, so stats never scan UserEpoch no matter how many users there are.
+    """
+
+    id = fields.IntField(pk=True)
+    epoch = fields.OneToOneField("app.Epoch", related_name="stats")
+    stakers_count = fields.IntField(default=0)  # users with epoch_lowest_balance above zero
+    # sum of epoch_lowest_balance, staked points and projected payout are derived from it like rewards are
+    epoch_lowest_balance_sum = fields.data.DecimalField(max_digits=30, decimal_places=4, default=0)
+    modified_at = fields.DatetimeField(auto_now=True)
+
+    def __str__(self):
+        return f"EpochStats of epoch №{self.epoch_id}"
+
+    class Meta:
+        table = "epoch_stats"
+
+
+class BalanceEvent(Model):
+    """Append-only ledger of applied points log events, guarantees that every event is applied only once"""
+
+    id = fields.BigIntField(pk=True, generated=False)  # same as discord message id
+    sender_id = fields.BigIntField()
+    receivers_ids = fields.JSONField()
+    points = fields.data.DecimalField(max_digits=15, decimal_places=4)
+    epochs_ids = fields.JSONField()  # epochs which were open when the event happened
+    created_at = fields.DatetimeField()  # when the message was posted
+
+    def __str__(self):
+        return f"BalanceEvent №{self.id}"
+
+    class Meta:
+        table = "balance_event"
+
+
+class JobCheckpoint(Model):
+    """Progress of long running jobs, so they can be resumed after restart"""
+
+    name = fields.CharField(max_length=64, pk=True)
+    value = fields.CharField(max_length=255)
+    modified_at = fields.DatetimeField(auto_now=True)
+
+    def __str__(self):
+        return f"JobCheckpoint {self.name}"
+
+    class Meta:
+        table = "job_checkpoint"
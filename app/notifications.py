@@ -0,0 +1,81 @@
+"""
+Keep in-memory state of several bot processes in sync via Postgres LISTEN/NOTIFY.
+E.g. onboarding process lets points log process know that user started staking.
+"""
+import asyncio
+import logging
+
+import asyncpg
+from tortoise import Tortoise
+from sentry_sdk import capture_exception
+
+from app.models import Epoch
+from app.queries import NOTIFY
+from app.caches import StakingRegistry, EpochProvider
+
+STAKING_CHANNEL = "hodl_bot_staking"
+EPOCHS_CHANNEL = "hodl_bot_epochs"
+RECONNECT_IN_SECONDS = 5
+
+
+async def notify(channel: str, payload: str) -> None:
+    await Tortoise.get_connection("default").execute_query(NOTIFY, [channel, payload])
+
+
+async def notify_staking_changed(user_id: int, is_staking: bool) -> None:
+    await notify(STAKING_CHANNEL, f"{user_id}:{int(is_staking)}")
+
+
+async def notify_epoch_created(epoch: Epoch) -> None:
+    await notify(EPOCHS_CHANNEL, str(epoch.id))
+
+
+class NotificationsListener:
+    """
+    Apply changes made by other processes to in-memory state of this one.
+    Notifications sent while connection was down are lost, so the state is reloaded after every reconnect.
+    """
+
+    def __init__(self, credentials: dict, staking_registry: StakingRegistry, epoch_provider: EpochProvider):
+        self.credentials = credentials
+        self.staking_registry = staking_registry
+        self.epoch_provider = epoch_provider
+
+    async def run(self) -> None:
+        is_reconnect = False
+        while True:
+            try:
+                connection = await asyncpg.connect(**self.credentials)
+                closed = asyncio.Event()
+                connection.add_termination_listener(lambda _: closed.set())
+                await connection.add_listener(STAKING_CHANNEL, self.on_staking_changed)
+                await connection.add_listener(EPOCHS_CHANNEL, self.on_epoch_created)
+                if is_reconnect:
+                    await self.staking_registry.reconcile()
+                    await self.epoch_provider.refresh()
+                is_reconnect = True
+                try:
+                    await closed.wait()
+                finally:
+                    await connection.close()
+                logging.warning(":::hodl_bot: notifications connection was closed, reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f":::hodl_bot: {e}")
+                capture_exception(e)
+            await asyncio.sleep(RECONNECT_IN_SECONDS)
+
+    def on_staking_changed(self, connection, pid: int, channel: str, payload: str) -> None:
+        user_id, is_staking = payload.split(":")
+        self.staking_registry.set_staking(int(user_id), is_staking == "1")
+
+    def on_epoch_created(self, connection, pid: int, channel: str, payload: str) -> None:
+        asyncio.ensure_future(self.refresh_epochs())
+
+    async def refresh_epochs(self) -> None:
+        try:
+            await self.epoch_provider.refresh()
+        except Exception as e:
+            logging.error(f":::hodl_bot: {e}")
+            capture_exception(e)
@@ -0,0 +1,88 @@
+import re
+import datetime
+from abc import ABC, abstractmethod
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Optional, Type
+
+from discord.utils import snowflake_time
+
+import config
+from app.batching import PointsEvent
+
+
+# same as discord.Message.raw_mentions, so messages can be parsed without discord.Message (e.g. from JSON dump)
+MENTIONS_REGEX = re.compile("<@!?([0-9]+)>")
+
+
+def get_message_created_at(message_id: int) -> datetime.datetime:
+    """Aware creation datetime of discord message (discord.py returns naive UTC datetime)"""
+    return snowflake_time(message_id).replace(tzinfo=datetime.timezone.utc)
+
+
+class PointsLogParser(ABC):
+    """Turns messages posted to points log channel into PointsEvent, unparseable messages are counted and skipped"""
+
+    def __init__(self):
+        self.parsed_count = 0
+        self.skipped_count = 0
+
+    def parse(self, message_id: int, content: str) -> Optional[PointsEvent]:
+        try:
+            event = self.parse_message(message_id, content)
+        except (ValueError, InvalidOperation):
+            event = None
+        if event is None:
+            self.skipped_count += 1
+        else:
+            self.parsed_count += 1
+        return event
+
+    @abstractmethod
+    def parse_message(self, message_id: int, content: str) -> Optional[PointsEvent]:
+        """Return None if the message isn't a points transfer"""
+
+    def stats(self) -> dict:
+        return {"parsed_count": self.parsed_count, "skipped_count": self.skipped_count}
+
+
+class AccountantParser(PointsLogParser):
+    """
+    Messages posted by The Accountant, first mention is the sender and the rest are receivers, e.g.
+    `<@sender> sent <:points:915573121631793162>1,000 to <@receiver> <@receiver>`
+    """
+
+    points_regex = re.compile("<:points:915573121631793162>(\\d*\\.?\\d+)")
+
+    def parse_message(self, message_id: int, content: str) -> Optional[PointsEvent]:
+        mentions = self.parse_mentions(content)
+        # remove comma from string (because of The Accountant Bot)
+        points = self.points_regex.search(content.replace(",", ""))
+        if not mentions or not points:
+            return None
+        return PointsEvent(
+            message_id=message_id,
+            created_at=get_message_created_at(message_id),
+            sender_id=mentions[0],
+            receivers_ids=mentions[1:],
+            points=Decimal(points.group(1)),
+        )
+
+    @staticmethod
+    def parse_mentions(content: str) -> List[int]:
+        return [int(user_id) for user_id in MENTIONS_REGEX.findall(content)]
+
+
+class AnyEmojiAccountantParser(AccountantParser):
+    """Same as AccountantParser but points can be prefixed with any custom emoji, survives emoji re-uploads"""
+
+    points_regex = re.compile("<a?:\\w+:\\d+>\\s*(\\d*\\.?\\d+)")
+
+
+POINTS_LOG_PARSERS: Dict[str, Type[PointsLogParser]] = {
+    "accountant": AccountantParser,
+    "accountant_any_emoji": AnyEmojiAccountantParser,
+}
+
+
+def get_points_log_parser(name: str = config.POINTS_LOG_PARSER) -> PointsLogParser:
+    return POINTS_LOG_PARSERS[name]()
@@ -0,0 +1,177 @@
+"""Raw SQL for hot paths which are too expensive to express through the ORM"""
+
+# apply a batch of points log deltas in one statement:
+# balances are moved by net delta and epoch_lowest_balance of every touched epoch can only go down.
+# Users are locked first, so lowest balances are calculated from the balance the batch was applied to.
+# Neither balance can go below zero (see PositiveValueValidator), real balance is never negative.
+# Missing UserEpoch is created on demand from the balance before the batch, so users who joined an epoch late
+# get a zero row from onboarding which then can't go up.
+APPLY_BALANCE_DELTAS = """
+WITH "locked" AS (
+    SELECT "id", "balance" FROM "user" WHERE "id" = ANY($1::bigint[]) FOR UPDATE
+), "updated" AS (
+    UPDATE "user" AS u SET "balance" = GREATEST(l."balance" + d."delta", 0), "modified_at" = CURRENT_TIMESTAMP
+    FROM "locked" AS l JOIN unnest($1::bigint[], $2::numeric[]) AS d("id", "delta") ON d."id" = l."id"
+    WHERE u."id" = l."id"
+    RETURNING u."id", l."balance" AS "initial_balance"
+)
+INSERT INTO "user_epoch" ("user_id", "epoch_id", "epoch_lowest_balance", "created_at", "modified_at")
+SELECT e."user_id", e."epoch_id", GREATEST(up."initial_balance" + e."lowest_delta", 0), CURRENT_TIMESTAMP,
+CURRENT_TIMESTAMP
+FROM unnest($3::bigint[], $4::int[], $5::numeric[]) AS e("user_id", "epoch_id", "lowest_delta")
+JOIN "updated" AS up ON up."id" = e."user_id"
+ON CONFLICT ("user_id", "epoch_id") DO UPDATE
+SET "epoch_lowest_balance" = LEAST("user_epoch"."epoch_lowest_balance", EXCLUDED."epoch_lowest_balance"),
+"modified_at" = CURRENT_TIMESTAMP
+WHERE EXCLUDED."epoch_lowest_balance" < "user_epoch"."epoch_lowest_balance"
+"""
+
+# UserEpoch of a user who just started staking, existing rows are kept as is
+INSERT_MISSING_USER_EPOCHS = """
+INSERT INTO "user_epoch" ("user_id", "epoch_id", "epoch_lowest_balance", "created_at", "modified_at")
+SELECT d."user_id", d."epoch_id", d."epoch_lowest_balance", CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+FROM unnest($1::bigint[], $2::int[], $3::numeric[]) AS d("user_id", "epoch_id", "epoch_lowest_balance")
+ON CONFLICT ("user_id", "epoch_id") DO NOTHING
+"""
+
+# create UserEpoch for all staking users in one statement (epoch_lowest_balance = balance).
+# Users without UserEpoch don't stake in the epoch, so non-staking users don't get rows
+INSERT_USER_EPOCHS_FOR_EPOCH = """
+INSERT INTO "user_epoch" ("user_id", "epoch_id", "epoch_lowest_balance", "created_at", "modified_at")
+SELECT u."id", $1, u."balance", CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+FROM "user" AS u
+WHERE u."is_staking"
+"""
+
+# set staking users balances to the real ones and lower epoch_lowest_balance of open epochs if balance dropped.
+# Balances which were changed by points log since they were read ($3) are kept, the next pass checks them again
+UPDATE_RECONCILED_BALANCES = """
+WITH corrected AS (
+    UPDATE "user" AS u SET "balance" = d."balance", "modified_at" = CURRENT_TIMESTAMP
+    FROM unnest($1::bigint[], $2::numeric[], $3::numeric[]) AS d("id", "balance", "old_balance")
+    WHERE u."id" = d."id" AND u."is_staking" AND u."balance" = d."old_balance"
+    RETURNING u."id", u."balance"
+)
+UPDATE "user_epoch" AS ue SET "epoch_lowest_balance" = c."balance", "modified_at" = CURRENT_TIMESTAMP
+FROM corrected AS c
+WHERE ue."user_id" = c."id" AND ue."epoch_id" = ANY($4::int[]) AND c."balance" < ue."epoch_lowest_balance"
+"""
+
+# calculate rewards for all users of the epoch in one pass, already calculated rewards are recalculated
+# (late points log events can still lower epoch_lowest_balance until rewards are reported)
+INSERT_EPOCH_REWARDS = """
+INSERT INTO "epoch_reward" ("user_id", "epoch_id", "staked_points", "reward", "created_at")
+SELECT ue."user_id", ue."epoch_id", ue."epoch_lowest_balance" * e."portfolio_percentage",
+ue."epoch_lowest_balance" * e."apy" * e."portfolio_percentage", CURRENT_TIMESTAMP
+FROM "user_epoch" AS ue
+JOIN "epoch" AS e ON e."id" = ue."epoch_id"
+WHERE ue."epoch_id" = $1 AND ue."epoch_lowest_balance" > 0
+ON CONFLICT ("user_id", "epoch_id") DO UPDATE
+SET "staked_points" = EXCLUDED."staked_points", "reward" = EXCLUDED."reward"
+WHERE ("epoch_reward"."staked_points", "epoch_reward"."reward") <> (EXCLUDED."staked_points", EXCLUDED."reward")
+"""
+
+# rewards of users whose epoch_lowest_balance dropped to zero (or who stopped staking) since they were calculated
+DELETE_STALE_EPOCH_REWARDS = """
+DELETE FROM "epoch_reward" AS er
+WHERE er."epoch_id" = $1 AND NOT EXISTS (
+    SELECT 1 FROM "user_epoch" AS ue
+    WHERE ue."user_id" = er."user_id" AND ue."epoch_id" = er."epoch_id" AND ue."epoch_lowest_balance" > 0
+)
+"""
+
+SELECT_EPOCH_REWARDS_SUMMARY = """
+SELECT count(*) AS "users_count", coalesce(sum("staked_points"), 0) AS "staked_points",
+coalesce(sum("reward"), 0) AS "reward"
+FROM "epoch_reward" WHERE "epoch_id" = $1
+"""
+
+# checkpoints which are message ids can only move forward
+UPSERT_MESSAGE_ID_CHECKPOINT = """
+INSERT INTO "job_checkpoint" ("name", "value", "modified_at") VALUES ($1, $2, CURRENT_TIMESTAMP)
+ON CONFLICT ("name") DO UPDATE
+SET "value" = GREATEST("job_checkpoint"."value"::bigint, EXCLUDED."value"::bigint)::varchar,
+"modified_at" = CURRENT_TIMESTAMP
+"""
+
+# append points log events to the ledger, returns ids of events which weren't there yet
+INSERT_BALANCE_EVENTS = """
+INSERT INTO "balance_event" ("id", "sender_id", "receivers_ids", "points", "epochs_ids", "created_at")
+SELECT d."id", d."sender_id", d."receivers_ids"::jsonb, d."points", d."epochs_ids"::jsonb, d."created_at"
+FROM unnest($1::bigint[], $2::bigint[], $3::text[], $4::numeric[], $5::text[], $6::timestamptz[])
+AS d("id", "sender_id", "receivers_ids", "points", "epochs_ids", "created_at")
+ON CONFLICT ("id") DO NOTHING
+RETURNING "id"
+"""
+
+# LISTEN/NOTIFY is used to keep in-memory state of several bot processes in sync
+NOTIFY = """
+SELECT pg_notify($1, $2)
+"""
+
+# replicas creating epochs at the same time are serialized, the lock is released on commit
+LOCK_EPOCHS_CREATION = """
+SELECT pg_advisory_xact_lock(hashtext('hodl_bot_epochs_creation'))
+"""
+
+# points log batches are applied concurrently with each other, but never while an epoch is being created
+LOCK_EPOCHS_CREATION_SHARED = """
+SELECT pg_advisory_xact_lock_shared(hashtext('hodl_bot_epochs_creation'))
+"""
+
+# epochs which points log events at or after given time count towards, including ones created after the event
+SELECT_EPOCHS_ENDING_AFTER = """
+SELECT "id", "end_datetime" FROM "epoch" WHERE "end_datetime" >= $1 ORDER BY "id"
+"""
+
+# leadership is held as long as the connection which took the lock is alive
+TRY_LEADER_LOCK = """
+SELECT pg_try_advisory_lock(hashtext($1)) AS "acquired"
+"""
+
+# onboarding and reconciliation statements are reused by every call, so they are prepared once per connection
+
+# staking info shown to user in DM, epoch_lowest_balance is NULL if there is no UserEpoch for the epoch
+SELECT_USER_STAKING_INFO = """
+SELECT u."balance", u."is_staking", ue."epoch_lowest_balance"
+FROM "user" AS u
+LEFT JOIN "user_epoch" AS ue ON ue."user_id" = u."id" AND ue."epoch_id" = $2
+WHERE u."id" = $1
+"""
+
+# register user if needed and start/stop staking in one statement, balance is kept as is when it's NULL
+UPSERT_USER_STAKING = """
+INSERT INTO "user" ("id", "balance", "is_staking", "staking_started_date", "created_at", "modified_at")
+VALUES ($1, coalesce($2::numeric, 0), $3, $4, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+ON CONFLICT ("id") DO UPDATE
+SET "balance" = coalesce($2::numeric, "user"."balance"), "is_staking" = $3, "staking_started_date" = $4,
+"modified_at" = CURRENT_TIMESTAMP
+"""
+
+RESET_USER_EPOCH_LOWEST_BALANCE = """
+UPDATE "user_epoch" SET "epoch_lowest_balance" = 0, "modified_at" = CURRENT_TIMESTAMP
+WHERE "user_id" = $1 AND "epoch_id" = $2
+"""
+
+SELECT_STAKING_USERS_AFTER = """
+SELECT "id", "balance" FROM "user" WHERE "is_staking" AND "id" > $1 ORDER BY "id" LIMIT $2
+"""
+
+# stats for admins, both are keyset paginated from the latest epoch backwards
+SELECT_EPOCHS_STATS_BEFORE = """
+SELECT e."id", e."end_datetime", e."apy", e."portfolio_percentage", e."settled_at",
+coalesce(s."stakers_count", 0) AS "stakers_count",
+coalesce(s."epoch_lowest_balance_sum", 0) AS "epoch_lowest_balance_sum"
+FROM "epoch" AS e
+LEFT JOIN "epoch_stats" AS s ON s."epoch_id" = e."id"
+WHERE e."id" < $1 ORDER BY e."id" DESC LIMIT $2
+"""
+
+SELECT_USER_HISTORY_BEFORE = """
+SELECT ue."epoch_id", ue."epoch_lowest_balance", e."end_datetime", e."apy", e."portfolio_percentage",
+er."reward"
+FROM "user_epoch" AS ue
+JOIN "epoch" AS e ON e."id" = ue."epoch_id"
+LEFT JOIN "epoch_reward" AS er ON er."user_id" = ue."user_id" AND er."epoch_id" = ue."epoch_id"
+WHERE ue."user_id" = $1 AND ue."epoch_id" < $2 ORDER BY ue."epoch_id" DESC LIMIT $3
+"""
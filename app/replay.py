@@ -0,0 +1,51 @@
+import json
+from typing import List, Optional
+
+import discord
+
+from app.models import JobCheckpoint
+from app.parsers import PointsLogParser
+from app.batching import PointsEventBatcher, POINTS_LOG_HIGH_WATER_MARK
+
+
+async def get_high_water_mark() -> Optional[int]:
+    checkpoint = await JobCheckpoint.get_or_none(name=POINTS_LOG_HIGH_WATER_MARK)
+    return int(checkpoint.value) if checkpoint else None
+
+
+async def submit_message(batcher: PointsEventBatcher, parser: PointsLogParser, message_id: int, content: str) -> bool:
+    event = parser.parse(message_id, content)
+    return event is not None and await batcher.submit(event)
+
+
+async def replay_channels_history(
+    channels: List[discord.TextChannel], batcher: PointsEventBatcher, parser: PointsLogParser, after_message_id: int
+) -> int:
+    """Submit points log messages posted after given one (e.g. while bot was offline), see PointsEventBatcher"""
+    replayed_count = 0
+    for position, channel in enumerate(channels):
+        # channels are replayed one by one, so replay cursor moves only with the last one, until then
+        # high water mark stays below messages of channels which aren't replayed yet
+        is_last_channel = position == len(channels) - 1
+        # history is fetched in pages of 100 messages, oldest first so replay cursor only moves forward
+        async for message in channel.history(limit=None, after=discord.Object(id=after_message_id), oldest_first=True):
+            if await submit_message(batcher, parser, message.id, message.system_content):
+                replayed_count += 1
+            if is_last_channel:
+                batcher.replay_cursor = message.id
+    return replayed_count
+
+
+async def replay_json_dump(path: str, batcher: PointsEventBatcher, parser: PointsLogParser) -> int:
+    """Submit points log messages from channel exported to JSON (DiscordChatExporter format)"""
+    with open(path) as f:
+        messages = json.load(f)["messages"]
+    high_water_mark = await get_high_water_mark() or 0
+    replayed_count = 0
+    for message in sorted(messages, key=lambda message: int(message["id"])):
+        message_id = int(message["id"])
+        if message_id <= high_water_mark:
+            continue
+        if await submit_message(batcher, parser, message_id, message["content"]):
+            replayed_count += 1
+    return replayed_count
@@ -0,0 +1,62 @@
+import asyncio
+import logging
+from typing import Any, NamedTuple, Optional, Set
+
+from sentry_sdk import capture_exception
+
+from app.metrics import DM_SEND_QUEUE_DEPTH, DM_SENDS
+from app.constants import DM_SEND_RATE_PER_SECOND, DM_SEND_QUEUE_MAX_SIZE
+
+
+class OutgoingMessage(NamedTuple):
+    channel: Any  # anything with discord.abc.Messageable.send
+    content: Optional[str]
+    kwargs: dict
+
+
+class SendQueue:
+    """
+    Outgoing messages are started at most rate_per_second per second, so a surge of replies waits here
+    instead of running into Discord rate limits inside handler tasks. Messages over max_size are dropped.
+    """
+
+    def __init__(self, rate_per_second: float = DM_SEND_RATE_PER_SECOND, max_size: int = DM_SEND_QUEUE_MAX_SIZE):
+        self.interval = 1 / rate_per_second
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self._sending: Set[asyncio.Task] = set()
+
+    def put(self, channel, content: Optional[str] = None, **kwargs) -> bool:
+        """Queue message for sending, returns False if the queue is full and the message was dropped"""
+        try:
+            self.queue.put_nowait(OutgoingMessage(channel, content, kwargs))
+        except asyncio.QueueFull:
+            DM_SENDS.inc("dropped")
+            logging.warning(f":::hodl_bot: send queue is full, message to channel {channel.id} was dropped")
+            return False
+        DM_SEND_QUEUE_DEPTH.set(self.queue.qsize())
+        return True
+
+    async def drain(self) -> None:
+        """Wait until all queued messages are sent"""
+        await self.queue.join()
+
+    async def run(self) -> None:
+        """Consume the queue forever, slow sends don't hold back the ones after them"""
+        while True:
+            message = await self.queue.get()
+            DM_SEND_QUEUE_DEPTH.set(self.queue.qsize())
+            task = asyncio.ensure_future(self.send(message))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+            await asyncio.sleep(self.interval)
+
+    async def send(self, message: OutgoingMessage) -> None:
+        try:
+            await message.channel.send(message.content, **message.kwargs)
+            DM_SENDS.inc("sent")
+        except Exception as e:
+            DM_SENDS.inc("failed")
+            logging.error(f":::hodl_bot: failed to send message to channel {message.channel.id}: {e}")
+            capture_exception(e)
+        finally:
+            self.queue.task_done()
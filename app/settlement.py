@@ -0,0 +1,62 @@
+import csv
+import pathlib
+from typing import List
+
+from tortoise import timezone
+from tortoise.transactions import in_transaction
+
+from app.models import Epoch, EpochReward
+from app.queries import INSERT_EPOCH_REWARDS, DELETE_STALE_EPOCH_REWARDS, SELECT_EPOCH_REWARDS_SUMMARY
+from app.constants import REWARDS_REPORT_CHUNK_SIZE, REWARDS_REPORT_MAX_ROWS_PER_FILE
+
+
+async def settle_epoch(epoch: Epoch) -> None:
+    """Calculate rewards for all users of the ended epoch, calling it again recalculates them"""
+    async with in_transaction() as connection:
+        await connection.execute_query(DELETE_STALE_EPOCH_REWARDS, [epoch.id])
+        await connection.execute_query(INSERT_EPOCH_REWARDS, [epoch.id])
+        epoch.settled_at = timezone.now()
+        await epoch.save(update_fields=["settled_at", "modified_at"], using_db=connection)
+
+
+async def get_epoch_rewards_summary(epoch: Epoch) -> dict:
+    async with in_transaction() as connection:
+        rows = await connection.execute_query_dict(SELECT_EPOCH_REWARDS_SUMMARY, [epoch.id])
+    return rows[0]
+
+
+async def write_rewards_report(epoch: Epoch, directory: pathlib.Path) -> List[pathlib.Path]:
+    """
+    Write epoch rewards to CSV files of at most REWARDS_REPORT_MAX_ROWS_PER_FILE rows.
+    Rewards are streamed from database in chunks, so memory usage doesn't depend on amount of users.
+    """
+    paths = []
+    report_file, writer, rows_in_file = None, None, 0
+    last_reward_id = 0
+    try:
+        while True:
+            rewards = (
+                await EpochReward.filter(epoch_id=epoch.id, id__gt=last_reward_id)
+                .order_by("id")
+                .limit(REWARDS_REPORT_CHUNK_SIZE)
+                .values_list("id", "user_id", "staked_points", "reward")
+            )
+            if not rewards:
+                break
+            for reward_id, user_id, staked_points, reward in rewards:
+                if writer is None or rows_in_file >= REWARDS_REPORT_MAX_ROWS_PER_FILE:
+                    if report_file is not None:
+                        report_file.close()
+                    path = directory / f"epoch_{epoch.id}_rewards_{len(paths) + 1}.csv"
+                    paths.append(path)
+                    report_file = open(path, "w", newline="")
+                    writer = csv.writer(report_file)
+                    writer.writerow(["user_id", "staked_points", "reward"])
+                    rows_in_file = 0
+                writer.writerow([user_id, staked_points, reward])
+                rows_in_file += 1
+            last_reward_id = rewards[-1][0]
+    finally:
+        if report_file is not None:
+            report_file.close()
+    return paths
@@ -1,13 +1,15 @@
 import datetime
 from decimal import Decimal
+from typing import List, Optional
 
-import aiohttp
 import sentry_sdk
 from tortoise import timezone
 from discord.ext import commands
+from tortoise.transactions import in_transaction
 
 import config
-from app.models import User, UserEpoch
+from app.models import Epoch
+from app.queries import INSERT_USER_EPOCHS_FOR_EPOCH, LOCK_EPOCHS_CREATION
 from app.constants import EPOCH_DURATION_IN_DAYS, SPACE_BETWEEN_EPOCHS_IN_SECONDS
 
 
@@ -42,23 +44,16 @@ def use_sentry(client, **sentry_args):
             raise error
 
 
-async def ensure_registered(user_id: int) -> User:
-    """Ensure that user is registered in our database"""
+def get_points_log_channel_id(guild_id: int) -> Optional[int]:
+    return config.POINTS_LOG_CHANNELS_IDS.get(guild_id, config.POINTS_LOG_CHANNEL_ID)
 
-    user, _ = await User.get_or_create(id=user_id)
-    return user
 
-
-async def get_user_balance(user_id: int) -> Decimal:
-    """Get current user balance"""
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.post(f"{config.ACCOUNTANT_API_PATH}/balances", json={"ids": [str(user_id)]}) as response:
-                response_json = await response.json()
-                str_points = response_json[0]["points"]
-                return Decimal(str_points)
-        except IndexError:
-            return Decimal(0)
+def get_points_log_channels_ids() -> List[int]:
+    """Points log channels of every guild"""
+    channels_ids = set(config.POINTS_LOG_CHANNELS_IDS.values())
+    if config.POINTS_LOG_CHANNEL_ID:
+        channels_ids.add(config.POINTS_LOG_CHANNEL_ID)
+    return sorted(channels_ids)
 
 
 def generate_start_datetime_for_latest_epoch(latest_epoch=None) -> datetime.datetime:
@@ -79,18 +74,33 @@ def generate_end_datetime_for_latest_epoch(latest_epoch=None) -> datetime.dateti
         )
 
 
-async def update_balance_and_epoch_lowest_balance(user_id: int, points: Decimal, epoch_id: int, is_sender=False):
-    """Note: you need to use these inside a transaction for better performance and to prevent race conditions"""
-    user = await User.filter(id=user_id).select_for_update().get(id=user_id)
-    user.balance = user.balance - points if is_sender else user.balance + points
-    await user.save(update_fields=["balance", "modified_at"])
-    # update epoch_lowest_balance
-    user_epoch, is_created = await UserEpoch.get_or_create(
-        user_id=user_id, epoch_id=epoch_id, defaults={"epoch_lowest_balance": user.balance}
-    )
-    if not is_created and user.balance < user_epoch.epoch_lowest_balance:
-        user_epoch.epoch_lowest_balance = user.balance
-        await user_epoch.save(update_fields=["epoch_lowest_balance", "modified_at"])
+async def create_genesis_epoch() -> Optional[Epoch]:
+    """Create the very first epoch, returns None if another replica has already created it"""
+    async with in_transaction() as connection:
+        await connection.execute_query(LOCK_EPOCHS_CREATION)
+        if await Epoch.exists():
+            return None
+        return await Epoch.create(
+            start_datetime=generate_start_datetime_for_latest_epoch(),
+            end_datetime=generate_end_datetime_for_latest_epoch(),
+        )
+
+
+async def create_next_epoch(latest_epoch: Epoch) -> Optional[Epoch]:
+    """
+    Create next epoch and UserEpoch for all staking users, rows are generated by database instead of Python.
+    Returns None if another replica has already created it.
+    """
+    async with in_transaction() as connection:
+        await connection.execute_query(LOCK_EPOCHS_CREATION)
+        if await Epoch.filter(id__gt=latest_epoch.id).exists():
+            return None
+        new_epoch = await Epoch.create(
+            start_datetime=generate_start_datetime_for_latest_epoch(latest_epoch),
+            end_datetime=generate_end_datetime_for_latest_epoch(latest_epoch),
+        )
+        await connection.execute_query(INSERT_USER_EPOCHS_FOR_EPOCH, [new_epoch.id])
+    return new_epoch
 
 
 def pp_points(balance: Decimal) -> str:
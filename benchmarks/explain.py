@@ -0,0 +1,135 @@
+"""
+EXPLAIN every hot query against a large fixture and fail if any of them scans a large table sequentially,
+so a query change or a missing index is caught before it reaches production.
+
+Usage: python -m benchmarks.explain --users 100000 --epochs 10
+"""
+import sys
+import json
+import asyncio
+import argparse
+from decimal import Decimal
+from typing import Iterator, List, Tuple
+
+from tortoise import Tortoise
+
+from app.models import Epoch, EpochReward, User
+from app.settlement import settle_epoch
+from app.queries import (
+    APPLY_BALANCE_DELTAS,
+    DELETE_STALE_EPOCH_REWARDS,
+    INSERT_EPOCH_REWARDS,
+    SELECT_EPOCH_REWARDS_SUMMARY,
+    SELECT_EPOCHS_ENDING_AFTER,
+    SELECT_STAKING_USERS_AFTER,
+    SELECT_USER_STAKING_INFO,
+    SELECT_USER_HISTORY_BEFORE,
+    UPDATE_RECONCILED_BALANCES,
+)
+from app.utils import (
+    create_next_epoch,
+    generate_start_datetime_for_latest_epoch,
+    generate_end_datetime_for_latest_epoch,
+)
+from app.constants import REWARDS_REPORT_CHUNK_SIZE, RECONCILE_BALANCES_CHUNK_SIZE, STATS_PAGE_SIZE
+from benchmarks.utils import setup_benchmark_db, teardown_benchmark_db, seed_users, timed
+
+# tables which grow with amount of users, "epoch" is small by nature and is fine to scan
+LARGE_TABLES = {"user", "user_epoch", "epoch_reward", "balance_event"}
+
+
+async def seed_epochs(epochs_count: int) -> Epoch:
+    """Chain of settled epochs, the latest one is open"""
+    epoch = await Epoch.create(
+        start_datetime=generate_start_datetime_for_latest_epoch(),
+        end_datetime=generate_end_datetime_for_latest_epoch(),
+    )
+    for _ in range(epochs_count - 1):
+        await settle_epoch(epoch)
+        epoch = await create_next_epoch(epoch)
+    await Tortoise.get_connection("default").execute_script("VACUUM ANALYZE")
+    return epoch
+
+
+def get_hot_queries(epoch: Epoch, settled_epoch: Epoch) -> List[Tuple[str, str, list]]:
+    """(label, sql, params) of queries which run per event or per user"""
+    users_ids = [1, 2, 3]
+    return [
+        ("staking registry load", User.filter(is_staking=True).values_list("id", flat=True).sql(), []),
+        ("reconciliation chunk", SELECT_STAKING_USERS_AFTER, [0, RECONCILE_BALANCES_CHUNK_SIZE]),
+        ("onboarding staking info", SELECT_USER_STAKING_INFO, [1, epoch.id]),
+        (
+            "points log batch",
+            APPLY_BALANCE_DELTAS,
+            [users_ids, [Decimal(1)] * 3, users_ids, [epoch.id] * 3, [Decimal(-1)] * 3],
+        ),
+        ("points log batch epochs", SELECT_EPOCHS_ENDING_AFTER, [epoch.start_datetime]),
+        (
+            "reconciled balances",
+            UPDATE_RECONCILED_BALANCES,
+            [users_ids, [Decimal(1)] * 3, [Decimal(2)] * 3, [epoch.id]],
+        ),
+        ("settlement", INSERT_EPOCH_REWARDS, [settled_epoch.id]),
+        ("stale rewards", DELETE_STALE_EPOCH_REWARDS, [settled_epoch.id]),
+        ("rewards summary", SELECT_EPOCH_REWARDS_SUMMARY, [settled_epoch.id]),
+        ("user history page", SELECT_USER_HISTORY_BEFORE, [1, epoch.id, STATS_PAGE_SIZE]),
+        (
+            "rewards report chunk",
+            EpochReward.filter(epoch_id=settled_epoch.id, id__gt=0)
+            .order_by("id")
+            .limit(REWARDS_REPORT_CHUNK_SIZE)
+            .values_list("id", "user_id", "staked_points", "reward")
+            .sql(),
+            [],
+        ),
+    ]
+
+
+def iter_plan_nodes(node: dict) -> Iterator[dict]:
+    yield node
+    for child in node.get("Plans", []):
+        yield from iter_plan_nodes(child)
+
+
+async def explain(sql: str, params: list) -> dict:
+    rows = await Tortoise.get_connection("default").execute_query_dict(f"EXPLAIN (FORMAT JSON) {sql}", params)
+    plan = rows[0]["QUERY PLAN"]
+    return (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+
+
+async def main(users_count: int, epochs_count: int) -> bool:
+    await setup_benchmark_db()
+    try:
+        with timed(f"fixture of {users_count} users and {epochs_count} epochs"):
+            await seed_users(users_count)
+            epoch = await seed_epochs(epochs_count)
+        settled_epoch = await Epoch.filter(settled_at__not_isnull=True).order_by("-id").first()
+        is_ok = True
+        for label, sql, params in get_hot_queries(epoch, settled_epoch or epoch):
+            plan = await explain(sql, params)
+            seq_scans = sorted(
+                {
+                    node["Relation Name"]
+                    for node in iter_plan_nodes(plan)
+                    if node["Node Type"] == "Seq Scan" and node.get("Relation Name") in LARGE_TABLES
+                }
+            )
+            scans = ", ".join(
+                f"{node['Node Type']} on {node['Relation Name']}"
+                for node in iter_plan_nodes(plan)
+                if "Relation Name" in node
+            )
+            print(f"{label}: {'SEQ SCAN on ' + ', '.join(seq_scans) if seq_scans else 'ok'} ({scans})")
+            is_ok = is_ok and not seq_scans
+        return is_ok
+    finally:
+        await teardown_benchmark_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--epochs", type=int, default=10)
+    args = parser.parse_args()
+    if not asyncio.run(main(args.users, args.epochs)):
+        sys.exit(1)
@@ -0,0 +1,128 @@
+"""
+Stand-ins for Discord and The Accountant, so cogs can be driven without network access.
+Only attributes and methods which cogs actually use are implemented.
+"""
+import asyncio
+import datetime
+from typing import List, Optional
+
+import discord
+from aiohttp import web
+
+import config
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.sent_messages_count = 0
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> None:
+        self.sent_messages_count += 1
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int = 1):
+        self.id = guild_id
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int):
+        self.id = channel_id
+        self.sent_messages_count = 0
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> None:
+        self.sent_messages_count += 1
+
+
+class FakeMessage:
+    def __init__(self, message_id: int, author: FakeUser, channel: FakeChannel, content: str, guild=None):
+        self.id = message_id
+        self.author = author
+        self.channel = channel
+        self.guild = guild
+        self.content = content
+        self.system_content = content
+
+
+class FakeComponentContext:
+    def __init__(self, author: FakeUser):
+        self.author = author
+        self.author_id = author.id
+        self.edits_count = 0
+
+    async def edit_origin(self, **fields) -> None:
+        self.edits_count += 1
+
+
+def generate_message_id(at: Optional[datetime.datetime] = None, sequence: int = 0) -> int:
+    """Snowflake for given time, `sequence` makes ids unique within the same millisecond"""
+    return discord.utils.time_snowflake(at or datetime.datetime.utcnow()) + sequence
+
+
+def points_log_message(message_id: int, sender_id: int, receivers_ids: List[int], points: int) -> FakeMessage:
+    """Message as it's posted by The Accountant to points log channel"""
+    mentions = " ".join(f"<@!{receiver_id}>" for receiver_id in receivers_ids)
+    content = f"<@{sender_id}> sent <:points:915573121631793162>{points:,} to {mentions}"
+    return FakeMessage(
+        message_id=message_id,
+        author=FakeUser(0),
+        channel=FakeChannel(config.POINTS_LOG_CHANNEL_ID),
+        content=content,
+        guild=FakeGuild(),
+    )
+
+
+def direct_message(message_id: int, author: FakeUser, content: str = "hi") -> FakeMessage:
+    return FakeMessage(message_id=message_id, author=author, channel=FakeChannel(author.id), content=content)
+
+
+class FakeAccountant:
+    """The Accountant /balances endpoint, every user has a deterministic balance"""
+
+    def __init__(self, latency_in_ms: float = 0, echo_ids: bool = True):
+        self.latency = latency_in_ms / 1000
+        self.echo_ids = echo_ids  # if False, balances are returned in the order of requested ids only
+        self.failures: List[int] = []  # statuses of the next responses, e.g. [503] fails the next request once
+        self.requests_count = 0
+        self.requested_ids: List[List[int]] = []
+        self.runner: Optional[web.AppRunner] = None
+        self.api_path = ""
+
+    @staticmethod
+    def get_balance(user_id: int) -> int:
+        return user_id % 10_000
+
+    async def handle_balances(self, request: web.Request) -> web.Response:
+        self.requests_count += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        users_ids = [int(user_id) for user_id in (await request.json())["ids"]]
+        self.requested_ids.append(users_ids)
+        if self.failures:
+            return web.Response(status=self.failures.pop(0))
+        # users without points are unknown to The Accountant and left out
+        balances = [
+            {"id": str(user_id), "points": str(self.get_balance(user_id))}
+            for user_id in users_ids
+            if self.get_balance(user_id)
+        ]
+        if not self.echo_ids:
+            for balance in balances:
+                del balance["id"]
+        return web.json_response(balances)
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_post("/balances", self.handle_balances)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.api_path = f"http://127.0.0.1:{port}"
+        return self.api_path
+
+    async def stop(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
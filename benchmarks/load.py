@@ -0,0 +1,254 @@
+"""
+Load test cogs with synthetic Discord events against a local Postgres and a fake The Accountant.
+Cogs are driven directly, bot never connects to Discord.
+
+Usage:
+    python -m benchmarks.load  # all scenarios
+    python -m benchmarks.load --scenarios tip_storm airdrop --users 100000
+"""
+import os
+import time
+import random
+import asyncio
+import argparse
+import datetime
+from typing import List
+
+import discord
+from tortoise import timezone
+from discord.ext import commands
+
+from app.models import Epoch
+from app.db import get_connection_credentials
+from app.leader import LeaderElection
+from app.lifecycle import Lifecycle
+from app.metrics import DM_SENDS
+from app.accountant import AccountantClient
+from app.caches import StakingRegistry, EpochProvider
+from app.extensions.onboarding import OnboardingCog
+from app.utils import generate_start_datetime_for_latest_epoch, generate_end_datetime_for_latest_epoch
+from benchmarks.fakes import (
+    FakeAccountant,
+    FakeComponentContext,
+    FakeUser,
+    direct_message,
+    generate_message_id,
+    points_log_message,
+)
+from benchmarks.utils import (
+    count_db_queries,
+    get_benchmark_orm_config,
+    report,
+    reset_benchmark_db,
+    seed_users,
+    setup_benchmark_db,
+    teardown_benchmark_db,
+)
+
+EXTENSIONS = ["app.extensions.sync_discord", "app.extensions.onboarding", "app.extensions.epochs"]
+
+
+async def call_timed(latencies: List[float], handler, *args) -> None:
+    started_at = time.perf_counter()
+    await handler(*args)
+    latencies.append(time.perf_counter() - started_at)
+
+
+class LoadTest:
+    def __init__(self, bot: commands.Bot, args: argparse.Namespace):
+        self.bot = bot
+        self.args = args
+
+    async def prepare(self, users_count: int, staking_ratio: float) -> None:
+        """Fresh database and freshly loaded cogs, so scenarios don't affect each other"""
+        for extension in EXTENSIONS:
+            if extension in self.bot.extensions:
+                self.bot.unload_extension(extension)
+        await reset_benchmark_db()
+        await seed_users(users_count, staking_ratio)
+        await self.bot.staking_registry.load()
+        self.bot.epoch_provider.epochs = []
+        for extension in EXTENSIONS:
+            self.bot.load_extension(extension)
+
+    async def create_genesis_epoch(self, end_datetime: datetime.datetime = None) -> Epoch:
+        epoch = await Epoch.create(
+            start_datetime=generate_start_datetime_for_latest_epoch(),
+            end_datetime=end_datetime or generate_end_datetime_for_latest_epoch(),
+        )
+        self.bot.epoch_provider.add(epoch)
+        return epoch
+
+    async def points_log_storm(self, label: str, messages: list) -> None:
+        """Dispatch all points log messages at once, like gateway does, and wait until they are flushed"""
+        cog = self.bot.get_cog("SyncDiscordCog")
+        latencies = []
+        db_queries_count = count_db_queries()
+        started_at = time.perf_counter()
+        await asyncio.gather(*[call_timed(latencies, cog.on_message, message) for message in messages])
+        await cog.batcher.drain()
+        elapsed = time.perf_counter() - started_at
+        report(label, len(messages), elapsed, latencies, count_db_queries() - db_queries_count)
+
+    async def tip_storm(self) -> None:
+        users_count = self.args.users
+        await self.prepare(users_count, self.args.staking_ratio)
+        await self.create_genesis_epoch()
+        messages = [
+            points_log_message(
+                message_id=generate_message_id(sequence=i),
+                sender_id=random.randint(1, users_count),
+                receivers_ids=[random.randint(1, users_count)],
+                points=random.randint(1, 100),
+            )
+            for i in range(self.args.tips)
+        ]
+        await self.points_log_storm(f"tip storm ({len(messages)} tips)", messages)
+
+    async def airdrop(self) -> None:
+        users_count = self.args.users
+        await self.prepare(users_count, self.args.staking_ratio)
+        await self.create_genesis_epoch()
+        messages = [
+            points_log_message(
+                message_id=generate_message_id(sequence=i),
+                sender_id=random.randint(1, users_count),
+                receivers_ids=random.sample(range(1, users_count + 1), self.args.airdrop_receivers),
+                points=random.randint(1, 100),
+            )
+            for i in range(self.args.airdrops)
+        ]
+        await self.points_log_storm(
+            f"airdrop ({len(messages)} airdrops to {self.args.airdrop_receivers} receivers)", messages
+        )
+
+    async def onboarding_rush(self) -> None:
+        """New users DM the bot and start staking at the same time"""
+        await self.prepare(self.args.users, self.args.staking_ratio)
+        await self.create_genesis_epoch()
+        cog = self.bot.get_cog("OnboardingCog")
+        on_message_latencies, choose_staking_yes_latencies = [], []
+        users = [FakeUser(self.args.users + i) for i in range(1, self.args.onboarding_users + 1)]
+
+        async def onboard(user: FakeUser) -> None:
+            await call_timed(on_message_latencies, cog.on_message, direct_message(generate_message_id(), user))
+            # component callbacks are wrapped by discord_slash, call the function it wraps
+            await call_timed(
+                choose_staking_yes_latencies,
+                OnboardingCog.choose_staking_yes.func,
+                cog,
+                FakeComponentContext(user),
+            )
+
+        on_message_db_queries_count = count_db_queries("onboarding.on_message")
+        choose_staking_yes_db_queries_count = count_db_queries("onboarding.choose_staking_yes")
+        started_at = time.perf_counter()
+        await asyncio.gather(*[onboard(user) for user in users])
+        # replies to DMs are built after the debounce window
+        await cog.drain()
+        elapsed = time.perf_counter() - started_at
+        report(
+            f"onboarding rush ({len(users)} users), on_message",
+            len(users),
+            elapsed,
+            on_message_latencies,
+            count_db_queries("onboarding.on_message") - on_message_db_queries_count,
+        )
+        report(
+            f"onboarding rush ({len(users)} users), choose_staking_yes",
+            len(users),
+            elapsed,
+            choose_staking_yes_latencies,
+            count_db_queries("onboarding.choose_staking_yes") - choose_staking_yes_db_queries_count,
+        )
+
+    async def dm_spam(self) -> None:
+        """Staking users send bursts of DMs, every burst should cost one reply and one query"""
+        await self.prepare(self.args.users, staking_ratio=1)
+        await self.create_genesis_epoch()
+        cog = self.bot.get_cog("OnboardingCog")
+        latencies = []
+        users = [FakeUser(user_id) for user_id in range(1, self.args.spam_users + 1)]
+        messages = [direct_message(generate_message_id(), user) for user in users for _ in range(self.args.spam_dms)]
+        random.shuffle(messages)
+        db_queries_count = count_db_queries("onboarding.on_message")
+        sends_count = DM_SENDS.values.get(("sent",), 0)
+        started_at = time.perf_counter()
+        await asyncio.gather(*[call_timed(latencies, cog.on_message, message) for message in messages])
+        await cog.drain()
+        elapsed = time.perf_counter() - started_at
+        report(
+            f"dm spam ({len(users)} users, {self.args.spam_dms} DMs each)",
+            len(messages),
+            elapsed,
+            latencies,
+            count_db_queries("onboarding.on_message") - db_queries_count,
+        )
+        started_at = time.perf_counter()
+        await cog.send_queue.drain()
+        replies_count = DM_SENDS.values.get(("sent",), 0) - sends_count
+        print(f"dm spam: {replies_count:.0f} replies sent, queue drained in {time.perf_counter() - started_at:.2f}s")
+
+    async def epoch_rollover(self) -> None:
+        """Current epoch is about to end, events are users, staking ones get UserEpoch for the next epoch"""
+        users_count = self.args.rollover_users
+        await self.prepare(users_count, self.args.staking_ratio)
+        await self.create_genesis_epoch(end_datetime=timezone.now() + datetime.timedelta(minutes=1))
+        cog = self.bot.get_cog("EpochCog")
+        latencies = []
+        db_queries_count = count_db_queries()
+        started_at = time.perf_counter()
+        await call_timed(latencies, cog.check_increment_epoch)
+        elapsed = time.perf_counter() - started_at
+        db_queries_count = count_db_queries() - db_queries_count
+        report(f"epoch rollover ({users_count} users)", users_count, elapsed, latencies, db_queries_count)
+
+
+SCENARIOS = ["tip_storm", "airdrop", "onboarding_rush", "dm_spam", "epoch_rollover"]
+
+
+async def main(bot: commands.Bot, args: argparse.Namespace) -> None:
+    fake_accountant = FakeAccountant(latency_in_ms=args.accountant_latency_in_ms)
+    bot.accountant = AccountantClient(api_path=await fake_accountant.start())
+    bot.staking_registry = StakingRegistry()
+    bot.epoch_provider = EpochProvider()
+    await setup_benchmark_db()
+    bot.leader_election = LeaderElection(
+        credentials=get_connection_credentials(get_benchmark_orm_config()["connections"]["default"]["credentials"]),
+        name="hodl_bot_benchmark",
+    )
+    await bot.leader_election.elect()
+    # cogs are driven after the benchmark database is set up, so they don't wait for warm up
+    bot.lifecycle = Lifecycle(bot, orm_config=get_benchmark_orm_config(), wal_path=os.devnull)
+    bot.lifecycle.is_warmed_up.set()
+    load_test = LoadTest(bot, args)
+    try:
+        for scenario in args.scenarios:
+            await getattr(load_test, scenario)()
+    finally:
+        for extension in EXTENSIONS:
+            if extension in bot.extensions:
+                bot.unload_extension(extension)
+        bot.leader_election.resign()
+        await bot.accountant.close()
+        await fake_accountant.stop()
+        await teardown_benchmark_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--users", type=int, default=100_000, help="users in database for all but rollover")
+    parser.add_argument("--staking-ratio", type=float, default=0.5)
+    parser.add_argument("--tips", type=int, default=10_000)
+    parser.add_argument("--airdrops", type=int, default=20)
+    parser.add_argument("--airdrop-receivers", type=int, default=500)
+    parser.add_argument("--onboarding-users", type=int, default=1_000)
+    parser.add_argument("--spam-users", type=int, default=100)
+    parser.add_argument("--spam-dms", type=int, default=10, help="DMs sent by every spamming user")
+    parser.add_argument("--rollover-users", type=int, default=1_000_000)
+    parser.add_argument("--accountant-latency-in-ms", type=float, default=50)
+    args = parser.parse_args()
+    # same event loop as the one cogs are bound to, bot itself never logs in
+    bot = commands.Bot(command_prefix="!hodl_bot.", help_command=None, intents=discord.Intents.default())
+    bot.loop.run_until_complete(main(bot, args))
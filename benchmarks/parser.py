@@ -0,0 +1,56 @@
+"""
+Measure points log parsing cost per message, doesn't need database or discord.
+
+Usage:
+    python -m benchmarks.parser  # synthetic corpus
+    python -m benchmarks.parser --corpus points_log.json  # channel exported via DiscordChatExporter
+"""
+import json
+import time
+import random
+import argparse
+
+from app.parsers import POINTS_LOG_PARSERS
+
+
+def generate_corpus(messages_count: int) -> list:
+    """Synthetic Accountant messages: tips, airdrops to many receivers, big amounts with commas and some noise"""
+    corpus = []
+    for message_id in range(messages_count):
+        mentions = " ".join(f"<@!{random.randint(10 ** 17, 10 ** 18)}>" for _ in range(random.choice([1, 1, 1, 5, 50])))
+        amount = f"{random.randint(1, 1_000_000):,}.{random.randint(0, 99)}"
+        content = f"<@{random.randint(10 ** 17, 10 ** 18)}> sent <:points:915573121631793162>{amount} to {mentions}"
+        if message_id % 100 == 0:
+            content = "points log maintenance, please ignore"
+        corpus.append({"id": str(10 ** 17 + message_id), "content": content})
+    return corpus
+
+
+def benchmark_parser(name: str, corpus: list, rounds: int) -> None:
+    parser = POINTS_LOG_PARSERS[name]()
+    messages = [(int(message["id"]), message["content"]) for message in corpus]
+    started_at = time.perf_counter()
+    for _ in range(rounds):
+        for message_id, content in messages:
+            parser.parse(message_id, content)
+    elapsed = time.perf_counter() - started_at
+    parsed_messages_count = len(messages) * rounds
+    print(
+        f"{name}: {elapsed / parsed_messages_count * 1_000_000:.2f}µs per message, "
+        f"{parsed_messages_count / elapsed:.0f} messages/s, stats: {parser.stats()}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", help="path to channel exported to JSON")
+    parser.add_argument("--messages", type=int, default=10_000, help="size of synthetic corpus")
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+    if args.corpus:
+        with open(args.corpus) as f:
+            corpus = json.load(f)["messages"]
+    else:
+        corpus = generate_corpus(args.messages)
+    for name in POINTS_LOG_PARSERS:
+        benchmark_parser(name, corpus, args.rounds)
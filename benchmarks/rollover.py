@@ -0,0 +1,54 @@
+"""
+Time epoch rollover (creating next epoch and UserEpoch for staking users) against a local Postgres
+and report how much UserEpoch grows per epoch.
+
+Usage: python -m benchmarks.rollover --users 10000 100000 1000000 --staking-ratio 0.1
+"""
+import asyncio
+import argparse
+
+from tortoise import Tortoise
+
+from app.models import Epoch
+from app.utils import (
+    create_next_epoch,
+    generate_start_datetime_for_latest_epoch,
+    generate_end_datetime_for_latest_epoch,
+)
+from benchmarks.utils import setup_benchmark_db, reset_benchmark_db, teardown_benchmark_db, seed_users, timed
+
+
+async def benchmark_rollover(users_count: int, staking_ratio: float) -> None:
+    await reset_benchmark_db()
+    await seed_users(users_count, staking_ratio)
+    genesis_epoch = await Epoch.create(
+        start_datetime=generate_start_datetime_for_latest_epoch(),
+        end_datetime=generate_end_datetime_for_latest_epoch(),
+    )
+    with timed(f"rollover for {users_count} users"):
+        await create_next_epoch(genesis_epoch)
+    rows = await Tortoise.get_connection("default").execute_query_dict(
+        """
+        SELECT count(*) AS "rows_count", pg_total_relation_size('user_epoch') AS "size"
+        FROM "user_epoch"
+        """
+    )
+    size_in_mb = rows[0]["size"] / 1024 / 1024
+    print(f"user_epoch after rollover: {rows[0]['rows_count']} rows, {size_in_mb:.1f}MB with indexes")
+
+
+async def main(users_counts, staking_ratio: float) -> None:
+    await setup_benchmark_db()
+    try:
+        for users_count in users_counts:
+            await benchmark_rollover(users_count, staking_ratio)
+    finally:
+        await teardown_benchmark_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--staking-ratio", type=float, default=0.1)
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.staking_ratio))
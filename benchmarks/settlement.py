@@ -0,0 +1,52 @@
+"""
+Time reward settlement and report generation at epoch close against a local Postgres.
+
+Usage: python -m benchmarks.settlement --users 10000 100000 1000000
+"""
+import asyncio
+import pathlib
+import argparse
+import tempfile
+
+from app.models import Epoch
+from app.settlement import settle_epoch, write_rewards_report
+from app.utils import (
+    create_next_epoch,
+    generate_start_datetime_for_latest_epoch,
+    generate_end_datetime_for_latest_epoch,
+)
+from benchmarks.utils import setup_benchmark_db, reset_benchmark_db, teardown_benchmark_db, seed_users, timed
+
+
+async def benchmark_settlement(users_count: int) -> None:
+    await reset_benchmark_db()
+    await seed_users(users_count, staking_ratio=1)
+    genesis_epoch = await Epoch.create(
+        start_datetime=generate_start_datetime_for_latest_epoch(),
+        end_datetime=generate_end_datetime_for_latest_epoch(),
+    )
+    epoch = await create_next_epoch(genesis_epoch)
+    with timed(f"settlement for {users_count} users"):
+        await settle_epoch(epoch)
+    with timed(f"settlement for {users_count} users (already settled)"):
+        await settle_epoch(epoch)
+    with tempfile.TemporaryDirectory() as directory:
+        with timed(f"rewards report for {users_count} users"):
+            paths = await write_rewards_report(epoch, pathlib.Path(directory))
+        print(f"rewards report size: {sum(path.stat().st_size for path in paths)} bytes in {len(paths)} files")
+
+
+async def main(users_counts) -> None:
+    await setup_benchmark_db()
+    try:
+        for users_count in users_counts:
+            await benchmark_settlement(users_count)
+    finally:
+        await teardown_benchmark_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+    asyncio.run(main(args.users))
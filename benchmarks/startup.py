@@ -0,0 +1,119 @@
+"""
+Time bot startup until the first points log event is written to database against a local Postgres.
+Database and caches warm up while a fake gateway connects, the run fails if the first event takes over --max-seconds,
+so a startup phase which blocks event handling is caught before it reaches production.
+
+Usage: python -m benchmarks.startup --users 1000000 --gateway-latency 2 --max-seconds 5
+"""
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+from typing import List
+
+import discord
+from tortoise import Tortoise
+from discord.ext import commands
+
+from app.models import Epoch, User
+from app.leader import LeaderElection
+from app.lifecycle import Lifecycle
+from app.metrics import POINTS_LOG_EVENTS
+from app.db import get_connection_credentials
+from app.accountant import AccountantClient
+from app.caches import StakingRegistry, EpochProvider
+from app.utils import generate_start_datetime_for_latest_epoch, generate_end_datetime_for_latest_epoch
+from benchmarks.fakes import FakeMessage, generate_message_id, points_log_message
+from benchmarks.utils import get_benchmark_orm_config, setup_benchmark_db, teardown_benchmark_db, seed_users
+
+WARM_UP_PHASES = ["database", "caches", "wal"]
+
+
+class FakeGateway:
+    """Stands in for bot.start: connects after `latency` seconds and receives a points log message right away"""
+
+    def __init__(self, bot: commands.Bot, latency: float, message: FakeMessage):
+        self.bot = bot
+        self.latency = latency
+        self.message = message
+
+    async def start(self, token: str) -> None:
+        await asyncio.sleep(self.latency)
+        # what discord.py does once READY and guilds are received
+        self.bot._ready.set()
+        asyncio.ensure_future(self.bot.get_cog("SyncDiscordCog").on_message(self.message))
+        # stays connected until shutdown
+        await asyncio.get_event_loop().create_future()
+
+
+async def prepare(users_count: int, staking_ratio: float) -> List[int]:
+    """Fixture the bot starts against, returns ids of two staking users"""
+    await setup_benchmark_db()
+    await seed_users(users_count, staking_ratio)
+    await Epoch.create(
+        start_datetime=generate_start_datetime_for_latest_epoch(),
+        end_datetime=generate_end_datetime_for_latest_epoch(),
+    )
+    staking_users_ids = await User.filter(is_staking=True).order_by("id").limit(2).values_list("id", flat=True)
+    # the bot opens its own connections while it warms up
+    await Tortoise.close_connections()
+    return staking_users_ids
+
+
+async def wait_for_first_event(lifecycle: Lifecycle, processed_count: float) -> None:
+    while POINTS_LOG_EVENTS.values.get(("processed",), 0) == processed_count:
+        await asyncio.sleep(0.001)
+    lifecycle.record_phase("first_event", time.perf_counter() - lifecycle.started_at)
+    lifecycle.shutdown_requested.set()
+
+
+async def main(bot: commands.Bot, args: argparse.Namespace) -> bool:
+    sender_id, receiver_id = await prepare(args.users, args.staking_ratio)
+    bot.staking_registry = StakingRegistry()
+    bot.epoch_provider = EpochProvider()
+    bot.accountant = AccountantClient()
+    orm_config = get_benchmark_orm_config()
+    # never elected, shutdown only resigns
+    bot.leader_election = LeaderElection(
+        credentials=get_connection_credentials(orm_config["connections"]["default"]["credentials"]),
+        name="hodl_bot_benchmark",
+    )
+    with tempfile.TemporaryDirectory() as wal_dir:
+        bot.lifecycle = Lifecycle(bot, orm_config=orm_config, wal_path=f"{wal_dir}/hodl-bot.wal")
+        with bot.lifecycle.phase("extensions"):
+            bot.load_extension("app.extensions.sync_discord")
+        message = points_log_message(generate_message_id(), sender_id, [receiver_id], 1)
+        bot.start = FakeGateway(bot, args.gateway_latency, message).start
+        processed_count = POINTS_LOG_EVENTS.values.get(("processed",), 0)
+        asyncio.ensure_future(wait_for_first_event(bot.lifecycle, processed_count))
+        try:
+            await bot.lifecycle.serve("token")
+        finally:
+            await bot.lifecycle.shutdown()
+    await Tortoise.init(config=orm_config)
+    await teardown_benchmark_db()
+
+    phases = bot.lifecycle.phases
+    print(", ".join(f"{phase} {seconds:.3f}s" for phase, seconds in phases.items()))
+    warm_up = sum(phases[phase] for phase in WARM_UP_PHASES)
+    # before warm up ran alongside the gateway, it had to finish before the bot started to connect
+    serial = phases["first_event"] + min(warm_up, phases["gateway"])
+    print(f"time to first event: {phases['first_event']:.3f}s (serial startup: ~{serial:.3f}s)")
+    if phases["first_event"] > args.max_seconds:
+        print(f"FAIL: first event took longer than {args.max_seconds}s")
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--staking-ratio", type=float, default=0.1)
+    parser.add_argument("--gateway-latency", type=float, default=2, help="login, READY and guilds, in seconds")
+    parser.add_argument("--max-seconds", type=float, default=5)
+    args = parser.parse_args()
+    # same event loop as the one cogs are bound to, bot itself never logs in
+    bot = commands.Bot(command_prefix="!hodl_bot.", help_command=None, intents=discord.Intents.default())
+    if not bot.loop.run_until_complete(main(bot, args)):
+        sys.exit(1)
@@ -0,0 +1,88 @@
+import re
+import time
+import pathlib
+import contextlib
+from typing import List, Optional
+
+from tortoise import Tortoise
+
+from constants import TORTOISE_ORM
+from app.metrics import DB_QUERIES
+
+
+MIGRATIONS_DIR = pathlib.Path(__file__).parent.parent / "app" / "migrations" / "app"
+
+
+def get_benchmark_orm_config() -> dict:
+    """Same as TORTOISE_ORM but pointed to a throwaway database, benchmarks never touch the real one"""
+    connection = TORTOISE_ORM["connections"]["default"]
+    credentials = {**connection["credentials"], "database": f"{connection['credentials']['database']}_benchmark"}
+    return {**TORTOISE_ORM, "connections": {"default": {**connection, "credentials": credentials}}}
+
+
+def get_upgrade_sql(migration_path: pathlib.Path) -> str:
+    """Upgrade part of aerich migration"""
+    sql = migration_path.read_text()
+    return sql.split("-- upgrade --", 1)[1].split("-- downgrade --", 1)[0]
+
+
+async def setup_benchmark_db() -> None:
+    """Create benchmark database and apply all migrations, so the schema (and indexes) matches production"""
+    config = get_benchmark_orm_config()
+    try:
+        await Tortoise.init(config=config, _create_db=True)
+    except Exception:
+        # database is left over from a previous run
+        await Tortoise.close_connections()
+        await Tortoise.init(config=config)
+    await reset_benchmark_db()
+
+
+async def reset_benchmark_db() -> None:
+    connection = Tortoise.get_connection("default")
+    await connection.execute_script("DROP SCHEMA public CASCADE; CREATE SCHEMA public;")
+    migrations = sorted(MIGRATIONS_DIR.glob("*.sql"), key=lambda path: int(re.match(r"\d+", path.name).group()))
+    for migration_path in migrations:
+        await connection.execute_script(get_upgrade_sql(migration_path))
+
+
+async def teardown_benchmark_db() -> None:
+    await Tortoise._drop_databases()
+
+
+async def seed_users(users_count: int, staking_ratio: float = 0.1) -> None:
+    """Insert synthetic users, `staking_ratio` of them are staking"""
+    await Tortoise.get_connection("default").execute_query(
+        """
+        INSERT INTO "user" ("id", "balance", "is_staking", "created_at", "modified_at")
+        SELECT g, round((random() * 10000)::numeric, 4), random() < $2, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+        FROM generate_series(1, $1::bigint) AS g
+        """,
+        [users_count, staking_ratio],
+    )
+    await Tortoise.get_connection("default").execute_script('ANALYZE "user"')
+
+
+@contextlib.contextmanager
+def timed(label: str):
+    started_at = time.perf_counter()
+    yield
+    print(f"{label}: {time.perf_counter() - started_at:.3f}s")
+
+
+def count_db_queries(handler: Optional[str] = None) -> int:
+    """Database round-trips made so far (by given handler), app.db engine counts them"""
+    return int(sum(count for labels, count in DB_QUERIES.values.items() if handler is None or labels == (handler,)))
+
+
+def percentile(values: List[float], percent: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * percent / 100), len(ordered) - 1)] if ordered else 0.0
+
+
+def report(label: str, events_count: int, elapsed: float, latencies: List[float], db_queries_count: int) -> None:
+    print(
+        f"{label}: {events_count / elapsed:.0f} events/s, "
+        f"p50 {percentile(latencies, 50) * 1000:.2f}ms, p99 {percentile(latencies, 99) * 1000:.2f}ms, "
+        f"{db_queries_count / events_count:.3f} db round-trips per event ({db_queries_count} total)"
+    )
@@ -1,25 +1,73 @@
 import sys
 import logging
+import argparse
 
 from discord import Intents, Activity, ActivityType
-from tortoise import Tortoise
 from discord.ext import commands
 from sentry_sdk.integrations.aiohttp import AioHttpIntegration
 from discord_slash import SlashCommand
 
 import config
 from constants import SENTRY_ENV_NAME, TORTOISE_ORM
+from app import metrics
 from app.utils import use_sentry
+from app.caches import StakingRegistry, EpochProvider
+from app.accountant import AccountantClient
+from app.db import get_connection_credentials
+from app.leader import LeaderElection
+from app.lifecycle import Lifecycle
+from app.notifications import NotificationsListener
+
+# several processes with different roles can share the load, they sync in-memory state via Postgres LISTEN/NOTIFY
+ROLES = {
+    "all": [
+        "app.extensions.sync_discord",
+        "app.extensions.onboarding",
+        "app.extensions.epochs",
+        "app.extensions.reconciliation",
+        "app.extensions.stats",
+    ],
+    # ingests points log channel
+    "points_log": ["app.extensions.sync_discord"],
+    # talks to users in DM and admins via slash commands, runs epoch and reconciliation jobs
+    "interactions": [
+        "app.extensions.onboarding",
+        "app.extensions.epochs",
+        "app.extensions.reconciliation",
+        "app.extensions.stats",
+    ],
+}
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--role", choices=ROLES, default="all", help="which part of the bot this process runs")
+    parser.add_argument("--metrics-port", type=int, default=config.METRICS_PORT, help="has to differ per process")
+    args = parser.parse_args()
+
     # initialize bot params
     intents = Intents.default()
     intents.members = True
     intents.messages = True
+    # don't receive gateway events which are handled by the other process
+    if args.role == "points_log":
+        intents.dm_messages = False
+    elif args.role == "interactions":
+        intents.guild_messages = False
     activity = Activity(type=ActivityType.playing, name=f"{config.PROJECT_NAME} APY".upper())
     bot = commands.Bot(command_prefix="!hodl_bot.", help_command=None, intents=intents, activity=activity)
-    SlashCommand(bot)
+    # points log events which weren't written to database by shutdown are kept here until the next start
+    bot.lifecycle = Lifecycle(
+        bot,
+        orm_config=TORTOISE_ORM,
+        wal_path="hodl-bot.wal" if args.role == "all" else f"hodl-bot-{args.role}.wal",
+    )
+    # slash commands are registered by the process which handles them, syncing replaces all of them
+    SlashCommand(bot, sync_commands="app.extensions.stats" in ROLES[args.role])
+    # in-memory state shared between extensions
+    bot.staking_registry = StakingRegistry()
+    bot.epoch_provider = EpochProvider()
+    bot.accountant = AccountantClient()
 
     # init sentry SDK
     use_sentry(
@@ -27,10 +75,12 @@ if __name__ == "__main__":
         dsn=config.SENTRY_API_KEY,
         environment=SENTRY_ENV_NAME,
         integrations=[AioHttpIntegration()],
+        traces_sample_rate=config.SENTRY_TRACES_SAMPLE_RATE,
     )
+    metrics.sentry_tracing_enabled = config.SENTRY_TRACES_SAMPLE_RATE > 0
 
     # setup logger
-    file_handler = logging.FileHandler(filename="hodl-bot.log")
+    file_handler = logging.FileHandler(filename="hodl-bot.log" if args.role == "all" else f"hodl-bot-{args.role}.log")
     stdout_handler = logging.StreamHandler(sys.stdout)
 
     logging.basicConfig(
@@ -38,8 +88,23 @@ if __name__ == "__main__":
         format="%(asctime)s %(levelname)s:%(message)s",
         handlers=[file_handler if config.LOG_TO_FILE else stdout_handler],
     )
-    bot.loop.run_until_complete(Tortoise.init(config=TORTOISE_ORM))
-    bot.load_extension("app.extensions.sync_discord")
-    bot.load_extension("app.extensions.onboarding")
-    bot.load_extension("app.extensions.epochs")
-    bot.run(config.TOKEN)
+    if args.metrics_port:
+        bot.loop.run_until_complete(metrics.start_metrics_server("127.0.0.1", args.metrics_port))
+    bot.loop.create_task(metrics.measure_event_loop_lag())
+    # dedicated connections outside of the pool
+    connection_credentials = get_connection_credentials(TORTOISE_ORM["connections"]["default"]["credentials"])
+    notifications_listener = NotificationsListener(
+        credentials=connection_credentials,
+        staking_registry=bot.staking_registry,
+        epoch_provider=bot.epoch_provider,
+    )
+    bot.loop.create_task(notifications_listener.run())
+    # replicas of the same role can run for availability, only the leader runs jobs and talks to users
+    bot.leader_election = LeaderElection(credentials=connection_credentials, name=f"hodl_bot_{args.role}")
+    bot.loop.create_task(bot.leader_election.run())
+    # extensions don't touch database when they are loaded, handlers wait for bot.lifecycle.wait_until_warmed_up
+    with bot.lifecycle.phase("extensions"):
+        for extension in ROLES[args.role]:
+            bot.load_extension(extension)
+    # database and caches are warmed up while the bot connects to Discord
+    bot.lifecycle.run(config.TOKEN)
@@ -2,6 +2,8 @@ TOKEN = ""
 # leave empty string if you don't use sentry
 SENTRY_API_KEY = ""
 POINTS_LOG_CHANNEL_ID = 42424242
+# guild id -> its own points log channel id, for guilds which share the points but don't post to POINTS_LOG_CHANNEL_ID
+POINTS_LOG_CHANNELS_IDS = {}
 LOG_LEVEL = "INFO"
 # should the bot log to file or to stdout
 LOG_TO_FILE = True
@@ -9,3 +11,7 @@ ACCOUNTANT_API_PATH = "https://www.hpmor.com/"
 SHOULD_STAKE_AFTER_FIRST_EPOCH = True  # sometimes we will need to only allow users to stake during genesis epoch
 PROJECT_NAME = "ECO"
 POINTS_EMOJI = "<:points:819648258112225316>"
+ADMIN_USERS_IDS = []  # these users will be DMed with rewards report at the end of each epoch
+POINTS_LOG_PARSER = "accountant"  # how points log channel is parsed, see app.parsers.POINTS_LOG_PARSERS
+METRICS_PORT = None  # e.g. 9740 serves Prometheus metrics on http://127.0.0.1:9740/metrics, None disables them
+SENTRY_TRACES_SAMPLE_RATE = 0.0  # share of handlers reported to sentry as performance transactions
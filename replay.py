@@ -0,0 +1,61 @@
+"""
+Replay points log channel exported to JSON (e.g. via DiscordChatExporter) without connecting to discord.
+Only messages posted after the latest processed one are applied.
+Exits with non-zero status if some of them couldn't be written, running it again replays them.
+
+Usage: python replay.py points_log.json
+"""
+import sys
+import asyncio
+import logging
+
+from tortoise import Tortoise
+
+from constants import TORTOISE_ORM
+from app.replay import replay_json_dump
+from app.batching import PointsEventBatcher
+from app.parsers import get_points_log_parser
+from app.caches import StakingRegistry
+from app.constants import POINTS_LOG_DUMP_MAX_RETRIES
+
+
+async def retry_failed_events(batcher: PointsEventBatcher) -> None:
+    """Retry batches which failed to flush with the bot's backoff, until they are written or it gives up"""
+    loop = asyncio.get_event_loop()
+    for _ in range(POINTS_LOG_DUMP_MAX_RETRIES):
+        if not batcher.failed_events:
+            return None
+        await asyncio.sleep(max(batcher.retry_at - loop.time(), 0))
+        await batcher.retry_failed_events()
+
+
+async def main(path: str) -> int:
+    await Tortoise.init(config=TORTOISE_ORM)
+    try:
+        staking_registry = StakingRegistry()
+        await staking_registry.load()
+        batcher = PointsEventBatcher(staking_registry=staking_registry)
+        batcher_task = asyncio.ensure_future(batcher.run())
+        try:
+            parser = get_points_log_parser()
+            replayed_count = await replay_json_dump(path, batcher, parser)
+            await batcher.drain()
+        finally:
+            batcher_task.cancel()
+        await retry_failed_events(batcher)
+        if batcher.failed_events:
+            logging.error(
+                f":::hodl_bot: {len(batcher.failed_events)} points log events couldn't be written, "
+                f"batcher stats: {batcher.stats()}"
+            )
+            return 1
+        logging.info(f":::hodl_bot: replayed {replayed_count} points log messages, parser stats: {parser.stats()}")
+        logging.info(f":::hodl_bot: batcher stats: {batcher.stats()}")
+        return 0
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s:%(message)s")
+    sys.exit(asyncio.run(main(sys.argv[1])))
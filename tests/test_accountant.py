@@ -0,0 +1,125 @@
+"""
+AccountantClient against a local aiohttp stand-in for The Accountant API.
+
+Usage: python -m unittest discover tests
+"""
+import time
+import asyncio
+import unittest
+from decimal import Decimal
+from unittest import mock
+
+import aiohttp
+
+from app.accountant import AccountantClient, AccountantError
+from benchmarks.fakes import FakeAccountant
+
+
+class AccountantClientTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.accountant = FakeAccountant()
+        api_path = await self.accountant.start()
+        self.client = AccountantClient(api_path=api_path, coalesce_window_in_ms=20, cache_ttl_in_seconds=60)
+        # retries wait 1ms, 2ms, 4ms instead of seconds
+        patcher = mock.patch("app.accountant.ACCOUNTANT_RETRY_BACKOFF_IN_SECONDS", 0.001)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.accountant.stop()
+
+    async def test_concurrent_lookups_are_coalesced(self):
+        balances = await asyncio.gather(*[self.client.get_balance(user_id) for user_id in range(1, 51)])
+        self.assertEqual(balances, [Decimal(user_id) for user_id in range(1, 51)])
+        self.assertEqual(self.accountant.requests_count, 1)
+        self.assertEqual(self.accountant.requested_ids, [list(range(1, 51))])
+
+    async def test_lookups_of_the_same_user_share_one_request(self):
+        balances = await asyncio.gather(*[self.client.get_balance(42) for _ in range(10)])
+        self.assertEqual(balances, [Decimal(42)] * 10)
+        self.assertEqual(self.accountant.requested_ids, [[42]])
+
+    async def test_cancelled_lookup_doesnt_cancel_the_others(self):
+        cancelled = asyncio.ensure_future(self.client.get_balance(1))
+        other = asyncio.ensure_future(self.client.get_balance(2))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        self.assertEqual(await other, Decimal(2))
+
+    async def test_balances_are_requested_in_chunks(self):
+        with mock.patch("app.accountant.ACCOUNTANT_BALANCES_CHUNK_SIZE", 10):
+            balances = await self.client.get_balances(range(1, 26))
+        self.assertEqual(balances, {user_id: Decimal(user_id) for user_id in range(1, 26)})
+        self.assertEqual(sorted(len(ids) for ids in self.accountant.requested_ids), [5, 10, 10])
+
+    async def test_cached_balance_is_reused_until_it_expires(self):
+        self.client.cache_ttl = 0.05
+        self.assertEqual(await self.client.get_balance(7), Decimal(7))
+        self.assertEqual(await self.client.get_balance(7), Decimal(7))
+        self.assertEqual(self.accountant.requests_count, 1)
+        self.assertEqual(self.client.cache_hits, 1)
+        await asyncio.sleep(0.06)
+        self.assertEqual(await self.client.get_balance(7), Decimal(7))
+        self.assertEqual(self.accountant.requests_count, 2)
+
+    async def test_expired_balances_are_pruned(self):
+        self.client.cache_ttl = 0.05
+        await self.client.get_balances(range(1, 101))
+        await asyncio.sleep(0.06)
+        await self.client.get_balances([1000])
+        self.assertEqual(list(self.client._cache), [1000])
+
+    async def test_server_errors_are_retried_with_backoff(self):
+        self.accountant.failures = [503, 502]
+        started_at = time.perf_counter()
+        self.assertEqual(await self.client.get_balances([3]), {3: Decimal(3)})
+        self.assertEqual(self.accountant.requests_count, 3)
+        self.assertEqual(self.client.retries_count, 2)
+        # 1ms after the first failure, 2ms after the second one
+        self.assertGreaterEqual(time.perf_counter() - started_at, 0.003)
+
+    async def test_server_errors_are_raised_once_retries_are_exhausted(self):
+        self.accountant.failures = [500] * 10
+        with mock.patch("app.accountant.ACCOUNTANT_MAX_RETRIES", 2):
+            with self.assertRaises(AccountantError):
+                await self.client.get_balances([3])
+        self.assertEqual(self.accountant.requests_count, 3)
+
+    async def test_server_error_is_raised_to_every_coalesced_lookup(self):
+        self.accountant.failures = [500] * 10
+        with mock.patch("app.accountant.ACCOUNTANT_MAX_RETRIES", 0):
+            results = await asyncio.gather(
+                self.client.get_balance(1), self.client.get_balance(2), return_exceptions=True
+            )
+        self.assertTrue(all(isinstance(result, AccountantError) for result in results))
+        self.assertEqual(self.client._cache, {})
+
+    async def test_client_errors_are_not_retried(self):
+        self.accountant.failures = [400]
+        with self.assertRaises(aiohttp.ClientResponseError):
+            await self.client.get_balances([3])
+        self.assertEqual(self.accountant.requests_count, 1)
+
+    async def test_unknown_users_have_zero_balance(self):
+        self.assertEqual(await self.client.get_balances([10_000]), {10_000: Decimal(0)})
+
+    async def test_balances_without_ids_are_matched_by_position(self):
+        self.accountant.echo_ids = False
+        self.assertEqual(await self.client.get_balances([5, 3, 4]), {5: Decimal(5), 3: Decimal(3), 4: Decimal(4)})
+
+    async def test_balances_without_ids_are_requested_one_by_one_if_some_are_left_out(self):
+        self.accountant.echo_ids = False
+        self.assertEqual(
+            await self.client.get_balances([5, 10_000, 3]), {5: Decimal(5), 10_000: Decimal(0), 3: Decimal(3)}
+        )
+        self.assertEqual(self.accountant.requests_count, 4)
+
+    async def test_unknown_user_doesnt_break_coalesced_lookups_without_ids(self):
+        self.accountant.echo_ids = False
+        balances = await asyncio.gather(*[self.client.get_balance(user_id) for user_id in (5, 10_000, 3)])
+        self.assertEqual(balances, [Decimal(5), Decimal(0), Decimal(3)])
+
+
+if __name__ == "__main__":
+    unittest.main()